@@ -5,7 +5,6 @@ from queue import Queue, Empty  # Add both Queue and Empty
 import threading
 import logging
 import os
-import requests
 from logging.handlers import RotatingFileHandler
 import configparser
 
@@ -36,6 +35,13 @@ app = Flask(__name__)
 progress_queue = Queue()
 download_state = DownloadState()
 
+# Index existing downloads without holding up startup
+threading.Thread(target=download_state.file_index.refresh, daemon=True).start()
+
+# Remove segment spools that can no longer be resumed
+threading.Thread(target=downloader.cleanup_orphaned_spools,
+                 args=(os.getenv('DOWNLOADS_DIR', '/downloads'),), daemon=True).start()
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -87,7 +93,7 @@ def progress():
 def test_post(post_id):
     """Test endpoint to check post accessibility and available resolutions"""
     try:
-        session = requests.Session()
+        session = downloader.get_session()
         headers = downloader.read_headers_from_file("header.txt")
         data, resolution_info, error = downloader.get_video_info(post_id, session, headers)
         
@@ -0,0 +1,158 @@
+import errno
+import fcntl
+import filecmp
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+
+logger = logging.getLogger('myfans_downloader')
+
+# ioctl that clones a file's extents on btrfs/XFS (linux/fs.h FICLONE)
+FICLONE = 0x40049409
+
+def file_crc32(path, chunk_size=1024 * 1024):
+    crc = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def reflink(src, dst):
+    """Create dst as a copy-on-write clone of src, raising OSError where unsupported"""
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+class ContentIndex:
+    """
+    Index of downloaded media by size and CRC32. A new file whose bytes match
+    an indexed one on the same filesystem is replaced by a reflink of it, or a
+    hardlink where reflinks are unsupported. A hardlink shares its inode and so
+    its modification date, so it is only used when both files carry the same
+    post date; otherwise the copy is kept. CRC32 only narrows the candidates;
+    files are compared byte for byte before linking. Checksums of earlier files
+    are computed lazily, the first time a file of the same size shows up.
+    """
+
+    def __init__(self, state_dir=None):
+        if state_dir is None:
+            state_dir = os.getenv('CONFIG_DIR', '')
+        self.db_file = os.path.join(state_dir, "content_index.db")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.saved_bytes = 0
+        self.linked_files = 0
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    crc32 INTEGER
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS files_size ON files (size)")
+
+    def add(self, path, size, crc=None):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO files (path, size, crc32) VALUES (?, ?, ?)",
+                              (path, size, crc))
+
+    def _forget(self, path):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _candidates(self, size, path):
+        with self.lock:
+            return self.conn.execute("SELECT path, crc32 FROM files WHERE size = ? AND path != ?",
+                                     (size, path)).fetchall()
+
+    def _is_duplicate(self, path, st, crc, candidate, candidate_crc):
+        try:
+            cst = os.stat(candidate)
+        except FileNotFoundError:
+            self._forget(candidate)
+            return False
+        if cst.st_size != st.st_size:
+            self._forget(candidate)
+            return False
+        if cst.st_dev != st.st_dev or cst.st_ino == st.st_ino:
+            return False
+        if candidate_crc is None:
+            candidate_crc = file_crc32(candidate)
+            self.add(candidate, cst.st_size, candidate_crc)
+        return candidate_crc == crc and filecmp.cmp(path, candidate, shallow=False)
+
+    @staticmethod
+    def _link(src, dst, allow_hardlink=True):
+        """
+        Atomically replace dst by a reflink or hardlink of src, returning the
+        method used, or None if only a hardlink was possible but not allowed.
+        """
+        tmp = f"{dst}.{threading.get_ident()}.dedupe"
+        try:
+            try:
+                reflink(src, tmp)
+                method = 'reflink'
+            except OSError as e:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EBADF):
+                    raise
+                if not allow_hardlink:
+                    return None
+                os.link(src, tmp)
+                method = 'hardlink'
+            os.replace(tmp, dst)
+            return method
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def link_duplicate(self, path, crc=None, mtime=None):
+        """
+        Index a newly written file and, if identical content is already stored,
+        replace it by a link to that copy. mtime is the date the new file will
+        be given; a hardlink is only made to a copy that already has it.
+        Returns (bytes saved, original path).
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        candidates = self._candidates(st.st_size, path)
+        if candidates and crc is None:
+            crc = file_crc32(path)
+
+        for candidate, candidate_crc in candidates:
+            try:
+                if not self._is_duplicate(path, st, crc, candidate, candidate_crc):
+                    continue
+                same_date = mtime is not None and abs(os.stat(candidate).st_mtime - mtime) < 1e-3
+                method = self._link(candidate, path, allow_hardlink=same_date)
+            except OSError as e:
+                logger.warning(f"Could not deduplicate {path} against {candidate}: {e}")
+                continue
+            if method is None:
+                logger.debug(f"Keeping {path}: identical {candidate} has another date and reflinks are unsupported")
+                continue
+            self.add(path, st.st_size, crc)
+            with self.lock:
+                self.saved_bytes += st.st_size
+                self.linked_files += 1
+            logger.info(f"Replaced {path} with a {method} of identical {candidate}")
+            return st.st_size, candidate
+
+        self.add(path, st.st_size, crc)
+        return 0, None
+
+_index_lock = threading.Lock()
+_index = None
+
+def get_content_index():
+    """Return the process-wide content index, opened on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ContentIndex()
+        return _index
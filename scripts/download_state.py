@@ -1,93 +1,153 @@
 import json
 import os
+import sqlite3
+import threading
 from datetime import datetime
 
+from scripts.fs_index import get_file_index
+
 class DownloadState:
-    def __init__(self, state_dir="/config"):
+    """
+    Download history kept in SQLite (download_state.db) in WAL mode, so every
+    update is a single-row write that is safe across worker threads and
+    survives a crash. A download_state.json from older versions is imported once.
+    Existing files are tracked by the shared file_index, refreshed with
+    file_index.refresh() and updated by the downloader after each write.
+    """
+
+    def __init__(self, state_dir=None):
+        if state_dir is None:
+            state_dir = os.getenv('CONFIG_DIR', '/config')
         self.state_file = os.path.join(state_dir, "download_state.json")
-        self.state = self._load_state()
-        # Convert completed_files list to set after loading
-        self.state["completed_files"] = set(self.state.get("completed_files", []))
-        self._scan_existing_files()
-
-    def _load_state(self):
-        if os.path.exists(self.state_file):
-            try:
-                with open(self.state_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                # If file is corrupted, return default state
-                return self._default_state()
-        return self._default_state()
-
-    def _default_state(self):
-        return {
-            "downloads": {},
-            "completed_files": [],
-            "failed_files": {},
-            "in_progress": {}
-        }
+        self.db_file = os.path.join(state_dir, "download_state.db")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+        self._migrate_json_state()
+        self.file_index = get_file_index()
+
+    def _create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    post_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    start_time TEXT,
+                    segments_total INTEGER NOT NULL DEFAULT 0,
+                    segments_downloaded INTEGER NOT NULL DEFAULT 0,
+                    last_updated TEXT
+                )""")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS completed_files (name TEXT PRIMARY KEY)")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS failed_files (
+                    post_id TEXT PRIMARY KEY,
+                    error TEXT
+                )""")
 
-    def _scan_existing_files(self):
-        """Scan existing files in downloads directory and add to completed files"""
-        downloads_dir = os.getenv('DOWNLOADS_DIR', '/downloads')
-        if os.path.exists(downloads_dir):
-            for root, _, files in os.walk(downloads_dir):
-                for file in files:
-                    if file.endswith(('.mp4', '.jpg', '.png', '.webp', '.gif')):
-                        self.state["completed_files"].add(file)
-        self.save_state()
-
-    def save_state(self):
-        """Save state to file, converting set to list for JSON serialization"""
+    def _migrate_json_state(self):
+        """Import the old whole-file JSON state, then move it aside"""
+        if not os.path.exists(self.state_file):
+            return
         try:
-            state_copy = self.get_serializable_state()
-            with open(self.state_file, 'w') as f:
-                json.dump(state_copy, f)
-        except Exception as e:
-            print(f"Error saving state: {e}")
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error reading old state file, skipping import: {e}")
+            state = {}
+
+        downloads = [
+            (str(post_id), info.get("status", "pending"), info.get("start_time"),
+             info.get("segments_total", 0), info.get("segments_downloaded", 0), info.get("last_updated"))
+            for post_id, info in state.get("downloads", {}).items()
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO downloads VALUES (?, ?, ?, ?, ?, ?)", downloads)
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO completed_files (name) VALUES (?)",
+                ((str(name),) for name in state.get("completed_files", [])))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO failed_files (post_id, error) VALUES (?, ?)",
+                ((str(post_id), str(error)) for post_id, error in state.get("failed_files", {}).items()))
+        os.replace(self.state_file, self.state_file + ".migrated")
 
     def add_download(self, post_id, status="pending", segments_total=0, segments_downloaded=0):
-        self.state["downloads"][post_id] = {
-            "status": status,
-            "start_time": datetime.now().isoformat(),
-            "segments_total": segments_total,
-            "segments_downloaded": segments_downloaded,
-            "last_updated": datetime.now().isoformat()
-        }
-        self.save_state()
+        now = datetime.now().isoformat()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT OR REPLACE INTO downloads
+                    (post_id, status, start_time, segments_total, segments_downloaded, last_updated)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (str(post_id), status, now, segments_total, segments_downloaded, now))
 
     def update_progress(self, post_id, segments_downloaded):
-        if post_id in self.state["downloads"]:
-            self.state["downloads"][post_id]["segments_downloaded"] = segments_downloaded
-            self.state["downloads"][post_id]["last_updated"] = datetime.now().isoformat()
-            self.save_state()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE downloads SET segments_downloaded = ?, last_updated = ? WHERE post_id = ?",
+                (segments_downloaded, datetime.now().isoformat(), str(post_id)))
 
     def mark_completed(self, post_id):
-        if post_id in self.state["downloads"]:
-            self.state["downloads"][post_id]["status"] = "completed"
-            self.state["completed_files"].add(post_id)
-            self.save_state()
+        with self.lock, self.conn:
+            updated = self.conn.execute(
+                "UPDATE downloads SET status = 'completed', last_updated = ? WHERE post_id = ?",
+                (datetime.now().isoformat(), str(post_id))).rowcount
+            if updated:
+                self.conn.execute("INSERT OR IGNORE INTO completed_files (name) VALUES (?)", (str(post_id),))
 
     def mark_failed(self, post_id, error):
-        if post_id in self.state["downloads"]:
-            self.state["downloads"][post_id]["status"] = "failed"
-            self.state["failed_files"][post_id] = error
-            self.save_state()
+        with self.lock, self.conn:
+            updated = self.conn.execute(
+                "UPDATE downloads SET status = 'failed', last_updated = ? WHERE post_id = ?",
+                (datetime.now().isoformat(), str(post_id))).rowcount
+            if updated:
+                self.conn.execute("INSERT OR REPLACE INTO failed_files (post_id, error) VALUES (?, ?)",
+                                  (str(post_id), str(error)))
 
     def is_completed(self, post_id):
-        return post_id in self.state["completed_files"]
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM completed_files WHERE name = ?", (str(post_id),)).fetchone()
+        return row is not None
 
     def get_progress(self, post_id):
-        return self.state["downloads"].get(post_id, {})
+        with self.lock:
+            row = self.conn.execute("""
+                SELECT status, start_time, segments_total, segments_downloaded, last_updated
+                FROM downloads WHERE post_id = ?""", (str(post_id),)).fetchone()
+        return self._download_info(row) if row else {}
 
     def is_file_exists(self, filename):
         """Check if file already exists in downloads"""
-        return filename in self.state["completed_files"]
+        return self.file_index.contains(filename) or self.is_completed(filename)
+
+    @staticmethod
+    def _download_info(row):
+        status, start_time, segments_total, segments_downloaded, last_updated = row
+        return {
+            "status": status,
+            "start_time": start_time,
+            "segments_total": segments_total,
+            "segments_downloaded": segments_downloaded,
+            "last_updated": last_updated
+        }
 
     def get_serializable_state(self):
         """Return a JSON-serializable version of the state"""
-        state_copy = self.state.copy()
-        if isinstance(state_copy.get("completed_files"), set):
-            state_copy["completed_files"] = list(state_copy["completed_files"])
-        return state_copy
\ No newline at end of file
+        with self.lock:
+            downloads = self.conn.execute("""
+                SELECT post_id, status, start_time, segments_total, segments_downloaded, last_updated
+                FROM downloads""").fetchall()
+            completed = self.conn.execute("SELECT name FROM completed_files").fetchall()
+            failed = self.conn.execute("SELECT post_id, error FROM failed_files").fetchall()
+        return {
+            "downloads": {row[0]: self._download_info(row[1:]) for row in downloads},
+            "completed_files": [row[0] for row in completed],
+            "failed_files": dict(failed),
+            "in_progress": {}
+        }
+
+    def close(self):
+        self.file_index.close()
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,50 @@
+import functools
+import logging
+import re
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger('myfans_downloader')
+
+PLACEHOLDERS = ('creator', 'date', 'title', 'id', 'number', 'letter')
+PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+
+class FilenameTemplate:
+    """
+    A filename pattern parsed once into literal text and placeholder fields.
+    Unknown placeholders are reported when the pattern is compiled and kept
+    as literal text, as the old string replacement did.
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.parts: List[Tuple[bool, str]] = []
+        self.unknown = []
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(pattern):
+            if match.start() > position:
+                self.parts.append((False, pattern[position:match.start()]))
+            name = match.group(1)
+            if name in PLACEHOLDERS:
+                self.parts.append((True, name))
+            else:
+                self.unknown.append(name)
+                self.parts.append((False, match.group(0)))
+            position = match.end()
+        if position < len(pattern):
+            self.parts.append((False, pattern[position:]))
+        self.fields = {name for is_field, name in self.parts if is_field}
+
+        if self.unknown:
+            logger.warning(f"Unknown placeholders in filename pattern {pattern!r}: "
+                           f"{', '.join('{' + name + '}' for name in self.unknown)}; "
+                           f"supported are {', '.join('{' + name + '}' for name in PLACEHOLDERS)}")
+        if not self.fields:
+            logger.warning(f"Filename pattern {pattern!r} has no placeholders, every post gets the same name")
+
+    def render(self, values: Dict[str, str]) -> str:
+        return ''.join(values[text] if is_field else text for is_field, text in self.parts)
+
+@functools.lru_cache(maxsize=32)
+def compile_template(pattern: str) -> FilenameTemplate:
+    """Return the compiled template for a pattern, parsing each pattern only once"""
+    return FilenameTemplate(pattern)
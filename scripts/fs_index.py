@@ -0,0 +1,152 @@
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+
+logger = logging.getLogger('myfans_downloader')
+
+MEDIA_EXTENSIONS = ('.mp4', '.jpg', '.png', '.webp', '.gif')
+
+class FileIndex:
+    """
+    Persisted index of the media file names under the downloads directory.
+    refresh() reloads the stored index and only lists directories whose mtime
+    changed since the last run; lookups are answered from memory. Downloads
+    finished in between are recorded with add().
+    """
+
+    def __init__(self, root, state_dir=None):
+        if state_dir is None:
+            state_dir = os.getenv('CONFIG_DIR', '')
+        self.root = os.path.abspath(root)
+        self.db_file = os.path.join(state_dir, "fs_index.db")
+        self.lock = threading.Lock()
+        self.dirs = {}
+        self.names = Counter()
+        self.ready = threading.Event()
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS dirs (
+                    path TEXT PRIMARY KEY,
+                    parent TEXT,
+                    mtime_ns INTEGER NOT NULL
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    dir TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    PRIMARY KEY (dir, name)
+                )""")
+
+    def contains(self, name):
+        """Whether a media file with this name exists anywhere under root"""
+        with self.lock:
+            return self.names[name] > 0
+
+    def add(self, path):
+        """Record a file written after the last refresh"""
+        folder, name = os.path.split(os.path.abspath(path))
+        with self.lock:
+            files = self.dirs.setdefault(folder, set())
+            if name not in files:
+                files.add(name)
+                self.names[name] += 1
+
+    def _load(self):
+        with self.lock:
+            # Start over from the stored index, files added since are listed again
+            self.dirs = {}
+            self.names = Counter()
+            stored = {row[0]: (row[1], row[2]) for row in self.conn.execute("SELECT path, parent, mtime_ns FROM dirs")}
+            for folder, name in self.conn.execute("SELECT dir, name FROM files"):
+                self.dirs.setdefault(folder, set()).add(name)
+                self.names[name] += 1
+        children = {}
+        for path, (parent, _) in stored.items():
+            children.setdefault(parent, []).append(path)
+        return stored, children
+
+    def _set_dir_files(self, folder, files):
+        with self.lock:
+            for name in self.dirs.pop(folder, ()):
+                self.names[name] -= 1
+                if self.names[name] <= 0:
+                    del self.names[name]
+            if files is not None:
+                self.dirs[folder] = set(files)
+                self.names.update(files)
+
+    def refresh(self):
+        """Bring the index up to date, listing only directories that changed"""
+        if not os.path.isdir(self.root):
+            self.ready.set()
+            return
+        stored, children = self._load()
+        seen = set()
+        changed = []
+        rescanned = 0
+        stack = [(self.root, None)]
+        while stack:
+            folder, parent = stack.pop()
+            try:
+                mtime_ns = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(folder)
+            if folder in stored and stored[folder][1] == mtime_ns:
+                # Unchanged listing: reuse stored files and subdirectories
+                stack.extend((child, folder) for child in children.get(folder, ()))
+                continue
+
+            rescanned += 1
+            files = []
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, folder))
+                        elif entry.name.endswith(MEDIA_EXTENSIONS):
+                            files.append(entry.name)
+            except OSError as e:
+                logger.warning(f"Could not list {folder}: {e}")
+                continue
+            self._set_dir_files(folder, files)
+            changed.append((folder, parent, mtime_ns, files))
+
+        removed = [path for path in stored if path not in seen]
+        for folder in removed:
+            self._set_dir_files(folder, None)
+
+        with self.lock, self.conn:
+            for folder in removed:
+                self.conn.execute("DELETE FROM dirs WHERE path = ?", (folder,))
+                self.conn.execute("DELETE FROM files WHERE dir = ?", (folder,))
+            for folder, parent, mtime_ns, files in changed:
+                self.conn.execute("INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                                  (folder, parent, mtime_ns))
+                self.conn.execute("DELETE FROM files WHERE dir = ?", (folder,))
+                self.conn.executemany("INSERT INTO files (dir, name) VALUES (?, ?)",
+                                      ((folder, name) for name in files))
+
+        logger.info(f"File index ready: {len(seen)} folders, {rescanned} rescanned, {len(removed)} removed")
+        self.ready.set()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+_index_lock = threading.Lock()
+_index = None
+
+def get_file_index():
+    """Return the process-wide index of DOWNLOADS_DIR, opened on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = FileIndex(os.getenv('DOWNLOADS_DIR', '/downloads'))
+        return _index
@@ -0,0 +1,108 @@
+import concurrent.futures
+import logging
+import os
+import threading
+from collections import deque
+
+logger = logging.getLogger('myfans_downloader')
+
+class LatencyTracker:
+    """Sliding window of recent request latencies, used to derive timeouts and hedge delays"""
+
+    def __init__(self, size: int = 500, min_samples: int = 20, min_timeout: float = 5.0, max_timeout: float = 30.0):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self.lock:
+            self.samples.append(latency)
+
+    def percentile(self, q: float):
+        """Return the q-th percentile (0-100), or None until enough samples were seen"""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def timeout(self) -> float:
+        """Request timeout of three times the observed p99, clamped to [min_timeout, max_timeout]"""
+        p99 = self.percentile(99)
+        if p99 is None:
+            return self.max_timeout
+        return max(self.min_timeout, min(self.max_timeout, p99 * 3))
+
+class Hedger:
+    """
+    Runs a request and, if it is still pending after `multiple` times the running
+    median latency, starts a duplicate and returns whichever finishes first.
+    At most max_ratio of all calls are hedged so a global slowdown does not
+    double the load. The request function receives a threading.Event it sets
+    once the request is actually sent; time spent before that, e.g. queued
+    for a connection slot, does not count towards the hedge delay.
+    """
+
+    def __init__(self, tracker: LatencyTracker, multiple: float, max_ratio: float = 0.05, workers: int = 32):
+        self.tracker = tracker
+        self.multiple = multiple
+        self.max_ratio = max_ratio
+        self.workers = workers
+        self.executor = None
+        self.calls = 0
+        self.hedged = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, tracker: LatencyTracker):
+        multiple = float(os.getenv('SEGMENT_HEDGE_MULTIPLIER', '3'))
+        workers = 2 * int(os.getenv('SEGMENT_DOWNLOAD_THREADS', '15')) + 2
+        return cls(tracker, multiple, workers=workers)
+
+    def _allow_hedge(self) -> bool:
+        with self.lock:
+            if self.hedged + 1 > self.calls * self.max_ratio + 1:
+                return False
+            self.hedged += 1
+            return True
+
+    def call(self, fn, label: str = ''):
+        with self.lock:
+            self.calls += 1
+        median = self.tracker.percentile(50)
+        if self.multiple <= 0 or median is None:
+            return fn(threading.Event())
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                                      thread_name_prefix='hedge')
+        started = threading.Event()
+        primary = self.executor.submit(fn, started)
+        primary.add_done_callback(lambda _: started.set())
+        started.wait()
+        try:
+            return primary.result(timeout=median * self.multiple)
+        except concurrent.futures.TimeoutError:
+            pass
+
+        if not self._allow_hedge():
+            return primary.result()
+
+        logger.debug(f"Hedging slow request {label} after {median * self.multiple:.2f}s")
+        backup = self.executor.submit(fn, threading.Event())
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+segment_latency = LatencyTracker()
+segment_hedger = Hedger.from_env(segment_latency)
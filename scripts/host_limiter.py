@@ -0,0 +1,165 @@
+import logging
+import os
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+
+logger = logging.getLogger('myfans_downloader')
+
+THROTTLE_STATUS_CODES = (429, 503)
+
+class SlotProbe:
+    """Filled in by the caller of HostConcurrencyLimiter.slot with what the request returned"""
+
+    def __init__(self):
+        self.bytes = 0
+
+class HostState:
+    """AIMD bookkeeping for a single host"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.latencies = []
+        self.errors = 0
+        self.bytes = 0
+        self.window_start = time.monotonic()
+        self.last_throughput = 0.0
+        self.baseline_latency = None
+        self.last_decrease = 0.0
+
+class HostConcurrencyLimiter:
+    """
+    Caps in-flight requests per host, shared by every video being downloaded.
+    With adaptive limits the cap follows AIMD: it grows by one per window of
+    healthy requests while throughput keeps up, halves on 429/503 or timeouts
+    and shrinks when the error rate or latency climbs.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 2, adaptive: bool = True, cooldown: float = 2.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.adaptive = adaptive
+        self.cooldown = cooldown
+        self.hosts = {}
+        self.progress_queues = set()
+        self.cond = threading.Condition()
+
+    @classmethod
+    def from_env(cls):
+        max_limit = int(os.getenv('MAX_SEGMENTS_PER_HOST', os.getenv('SEGMENT_DOWNLOAD_THREADS', '15')))
+        min_limit = int(os.getenv('SEGMENT_CONCURRENCY_MIN', '2'))
+        adaptive = bool(int(os.getenv('ADAPTIVE_CONCURRENCY', '1')))
+        return cls(max_limit, min_limit, adaptive)
+
+    def attach(self, progress_queue):
+        """Report concurrency changes to a progress stream"""
+        if progress_queue is not None:
+            with self.cond:
+                self.progress_queues.add(progress_queue)
+
+    def _state(self, host: str) -> HostState:
+        state = self.hosts.get(host)
+        if state is None:
+            initial = self.max_limit if not self.adaptive else max(self.min_limit, self.max_limit // 2)
+            state = self.hosts[host] = HostState(initial)
+        return state
+
+    @contextmanager
+    def slot(self, url: str):
+        """Hold one of the host's request slots for the duration of the block"""
+        host = urlparse(url).netloc
+        with self.cond:
+            state = self._state(host)
+            while state.in_flight >= state.limit:
+                self.cond.wait()
+            state.in_flight += 1
+
+        probe = SlotProbe()
+        started = time.monotonic()
+        outcome = 'ok'
+        try:
+            yield probe
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            outcome = f"HTTP {status}" if status in THROTTLE_STATUS_CODES else 'error'
+            raise
+        except requests.Timeout:
+            outcome = 'timeout'
+            raise
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            with self.cond:
+                state.in_flight -= 1
+                if self.adaptive:
+                    self._record(host, state, outcome, time.monotonic() - started, probe.bytes)
+                self.cond.notify_all()
+
+    def _record(self, host: str, state: HostState, outcome: str, latency: float, nbytes: int):
+        now = time.monotonic()
+        if outcome.startswith('HTTP') or outcome == 'timeout':
+            # Back off hard, but only once per cooldown so one burst does not collapse the limit
+            if now - state.last_decrease >= self.cooldown:
+                self._set_limit(host, state, state.limit // 2, outcome)
+                state.last_decrease = now
+            self._reset_window(state, now)
+            return
+
+        if outcome == 'error':
+            state.errors += 1
+        else:
+            state.latencies.append(latency)
+            state.bytes += nbytes
+
+        if len(state.latencies) + state.errors < state.limit:
+            return
+
+        # One window of roughly `limit` requests has completed, evaluate it
+        total = len(state.latencies) + state.errors
+        error_rate = state.errors / total
+        elapsed = max(now - state.window_start, 1e-6)
+        throughput = state.bytes / elapsed
+        median_latency = statistics.median(state.latencies) if state.latencies else None
+        if median_latency is not None:
+            if state.baseline_latency is None or median_latency < state.baseline_latency:
+                state.baseline_latency = median_latency
+            else:
+                # Let the baseline drift up slowly so a permanently slower edge is not punished forever
+                state.baseline_latency = state.baseline_latency * 0.95 + median_latency * 0.05
+
+        if error_rate > 0.1:
+            self._set_limit(host, state, int(state.limit * 0.75), f"error rate {error_rate:.0%}")
+            state.last_decrease = now
+        elif median_latency is not None and median_latency > 2 * state.baseline_latency:
+            self._set_limit(host, state, state.limit - 1,
+                            f"latency {median_latency:.2f}s vs baseline {state.baseline_latency:.2f}s")
+            state.last_decrease = now
+        elif throughput >= state.last_throughput * 0.95:
+            self._set_limit(host, state, state.limit + 1, f"throughput {throughput / 1048576:.1f} MB/s")
+        state.last_throughput = throughput
+        self._reset_window(state, now)
+
+    @staticmethod
+    def _reset_window(state: HostState, now: float):
+        state.latencies = []
+        state.errors = 0
+        state.bytes = 0
+        state.window_start = now
+
+    def _set_limit(self, host: str, state: HostState, new_limit: int, reason: str):
+        new_limit = max(self.min_limit, min(self.max_limit, new_limit))
+        if new_limit == state.limit:
+            return
+        message = f"Segment concurrency for {host}: {state.limit} -> {new_limit} ({reason})"
+        state.limit = new_limit
+        logger.info(message)
+        for progress_queue in self.progress_queues:
+            progress_queue.put(message)
+
+segment_limiter = HostConcurrencyLimiter.from_env()
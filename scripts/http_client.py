@@ -0,0 +1,74 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_headers_lock = threading.Lock()
+_headers_cache = {}
+_session_lock = threading.Lock()
+_session = None
+
+def header_file_path(filename="header.txt"):
+    return os.path.join(os.getenv('CONFIG_DIR', ''), filename)
+
+def read_headers(filename="header.txt"):
+    """
+    Return the request headers from CONFIG_DIR/filename. The file is parsed once
+    and only re-read when its mtime changes.
+    """
+    header_path = header_file_path(filename)
+    if not os.path.isfile(header_path):
+        raise FileNotFoundError(f"Header file not found at {header_path}")
+
+    mtime = os.stat(header_path).st_mtime_ns
+    with _headers_lock:
+        cached = _headers_cache.get(header_path)
+        if cached and cached[0] == mtime:
+            return dict(cached[1])
+
+    headers = {}
+    with open(header_path, 'r') as file:
+        for line in file:
+            if ': ' in line:
+                key, value = line.strip().split(': ', 1)
+                headers[key.lower()] = value
+
+    # Validate token presence
+    if 'authorization' not in headers or not headers['authorization'].startswith('Token token='):
+        raise ValueError("Invalid or missing authorization token in headers file")
+
+    with _headers_lock:
+        _headers_cache[header_path] = (mtime, headers)
+    return dict(headers)
+
+class SharedSession(requests.Session):
+    """Session whose requests default to the cached header.txt headers"""
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('headers') is None:
+            kwargs['headers'] = read_headers()
+        return super().request(method, url, **kwargs)
+
+def pool_settings():
+    """Connection pool sizes: HTTP_POOL_CONNECTIONS hosts, HTTP_POOL_MAXSIZE keep-alive connections each"""
+    segment_threads = int(os.getenv('SEGMENT_DOWNLOAD_THREADS', '15'))
+    pool_connections = int(os.getenv('HTTP_POOL_CONNECTIONS', '10'))
+    # Room for every segment worker plus a hedged duplicate, listing and API calls
+    pool_maxsize = int(os.getenv('HTTP_POOL_MAXSIZE', str(segment_threads * 2 + 8)))
+    return pool_connections, pool_maxsize
+
+def get_session():
+    """Return the process-wide session with pooled keep-alive connections per host"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_connections, pool_maxsize = pool_settings()
+            session = SharedSession()
+            adapter = HTTPAdapter(pool_connections=pool_connections,
+                                  pool_maxsize=pool_maxsize,
+                                  max_retries=3)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
@@ -0,0 +1,60 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+class MetadataCatalog:
+    """
+    gallery-dl style metadata for every downloaded media file, one row per
+    file grouped by creator. record() only writes when the metadata changed,
+    so re-syncing an unchanged library does not touch the catalog or sidecars.
+    """
+
+    def __init__(self, state_dir=None):
+        if state_dir is None:
+            state_dir = os.getenv('CONFIG_DIR', '')
+        self.db_file = os.path.join(state_dir, "metadata_catalog.db")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS media (
+                    path TEXT PRIMARY KEY,
+                    creator TEXT NOT NULL,
+                    post_id TEXT,
+                    metadata TEXT NOT NULL,
+                    updated_at TEXT
+                )""")
+
+    def record(self, creator, path, metadata):
+        """Store metadata for a media file, returning True if it was new or changed"""
+        text = json.dumps(metadata, ensure_ascii=False, indent=2)
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT metadata FROM media WHERE path = ?", (path,)).fetchone()
+            if row and row[0] == text:
+                return False
+            self.conn.execute("""
+                INSERT OR REPLACE INTO media (path, creator, post_id, metadata, updated_at)
+                VALUES (?, ?, ?, ?, ?)""",
+                (path, creator, str(metadata.get('post_id', '')), text, datetime.now().isoformat()))
+        return True
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+_catalog_lock = threading.Lock()
+_catalog = None
+
+def get_metadata_catalog():
+    """Return the process-wide metadata catalog, opened on first use"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = MetadataCatalog()
+        return _catalog
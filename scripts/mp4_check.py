@@ -0,0 +1,97 @@
+import mmap
+import os
+import struct
+from typing import NamedTuple, Optional
+
+MOOV = b'moov'
+MVHD = b'mvhd'
+
+class Mp4Check(NamedTuple):
+    """verdict is True/False when the box walk is conclusive, None when ffprobe has to decide"""
+    verdict: Optional[bool]
+    duration: Optional[float] = None
+    reason: str = ''
+
+def iter_boxes(buf, start: int, end: int):
+    """
+    Yield (type, payload_start, box_end) for the boxes in buf[start:end].
+    Raises ValueError when a box header is cut off or a box runs past end.
+    """
+    offset = start
+    while offset < end:
+        if end - offset < 8:
+            raise ValueError(f"truncated box header at {offset}")
+        size, box_type = struct.unpack_from('>I4s', buf, offset)
+        header = 8
+        if size == 1:
+            if end - offset < 16:
+                raise ValueError(f"truncated largesize header at {offset}")
+            size = struct.unpack_from('>Q', buf, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise ValueError(f"box {box_type!r} at {offset} overruns the file")
+        yield box_type, offset + header, offset + size
+        offset += size
+
+def parse_mvhd_duration(buf, start: int, end: int) -> Optional[float]:
+    """Movie duration in seconds from an mvhd payload"""
+    version = buf[start]
+    if version == 1:
+        if end - start < 32:
+            return None
+        timescale, duration = struct.unpack_from('>IQ', buf, start + 20)
+    else:
+        if end - start < 20:
+            return None
+        timescale, duration = struct.unpack_from('>II', buf, start + 12)
+    if not timescale:
+        return None
+    return duration / timescale
+
+def check_mp4(path: str, expected_duration: Optional[float] = None, tolerance: float = 0.05) -> Mp4Check:
+    """
+    Walk the top-level boxes of an MP4 without decoding it. The boxes must
+    exactly cover the file and include ftyp, a parseable moov and mdat.
+    A duration far from expected_duration is left to ffprobe to judge.
+    """
+    if os.path.splitext(path)[1].lower() not in ('.mp4', '.m4v', '.mov'):
+        return Mp4Check(None, reason='not an MP4 container')
+
+    size = os.path.getsize(path)
+    if size == 0:
+        return Mp4Check(False, reason='empty file')
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        try:
+            boxes = {}
+            for box_type, payload_start, box_end in iter_boxes(buf, 0, size):
+                boxes.setdefault(box_type, (payload_start, box_end))
+        except ValueError as e:
+            return Mp4Check(False, reason=str(e))
+
+        if b'ftyp' not in boxes:
+            return Mp4Check(False, reason='missing ftyp')
+        if b'moof' in boxes:
+            # Fragmented files keep their samples in moof/mdat pairs
+            return Mp4Check(None, reason='fragmented MP4')
+        if MOOV not in boxes:
+            return Mp4Check(False, reason='missing moov')
+        if b'mdat' not in boxes:
+            return Mp4Check(False, reason='missing mdat')
+
+        duration = None
+        try:
+            for box_type, payload_start, box_end in iter_boxes(buf, *boxes[MOOV]):
+                if box_type == MVHD:
+                    duration = parse_mvhd_duration(buf, payload_start, box_end)
+                    break
+        except ValueError as e:
+            return Mp4Check(False, reason=f"corrupt moov: {e}")
+
+    if duration is None:
+        return Mp4Check(None, reason='no movie duration')
+    if expected_duration and abs(duration - expected_duration) > max(2.0, expected_duration * tolerance):
+        return Mp4Check(None, duration, f"duration {duration:.1f}s, expected {expected_duration:.1f}s")
+    return Mp4Check(True, duration)
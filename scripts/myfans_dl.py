@@ -4,19 +4,37 @@ import pathlib
 import sys
 import time
 import json
-import uuid
+import errno
+import hashlib
+import shutil
+import zlib
 from queue import Queue, Empty
+from collections import OrderedDict, deque
 import subprocess
 import configparser
 from tqdm import tqdm
 from scripts.filename_utils import *
+from scripts.filename_template import compile_template
+from scripts.post_catalog import PostCatalog
+from scripts.fs_index import get_file_index
+from scripts.http_client import get_session, read_headers
+from scripts.segment_scheduler import segment_scheduler
+from scripts.host_limiter import segment_limiter
+from scripts.hedging import segment_hedger, segment_latency
+from scripts.verify_cache import get_verification_index
+from scripts.mp4_check import check_mp4
+from scripts.dedupe import file_crc32, get_content_index
+from scripts.metadata_catalog import get_metadata_catalog
+from scripts.ts_check import CorruptSegmentError, TsValidator, expected_body_length, segment_is_plain
+from scripts.variant_selection import RESOLUTION_HEIGHTS, disk_budget, estimate_variant_bytes, fallback_resolutions, select_variant
 import concurrent.futures
+import functools
 import threading
 import m3u8
 import logging
 from logging.handlers import RotatingFileHandler
 from typing import Optional, List, Dict, Any, Tuple
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 import requests
 from requests import Session
 import re
@@ -63,63 +81,895 @@ def thread_safe_log(level, message, progress_queue=None):
             progress_queue.put(message)
 
 def read_headers_from_file(filename):
-    headers = {}
-    config_dir = os.getenv('CONFIG_DIR', '')
-    header_path = os.path.join(config_dir, filename)
-    
-    if not os.path.isfile(header_path):
-        raise FileNotFoundError(f"Header file not found at {header_path}")
-        
-    with open(header_path, 'r') as file:
-        for line in file:
-            if ': ' in line:
-                key, value = line.strip().split(': ', 1)
-                headers[key.lower()] = value
-    
-    # Validate token presence
-    if 'authorization' not in headers or not headers['authorization'].startswith('Token token='):
-        raise ValueError("Invalid or missing authorization token in headers file")
-        
-    return headers
+    """Headers from CONFIG_DIR/filename, cached until the file changes"""
+    return read_headers(filename)
 
-def get_posts_for_page(base_url, page, headers):
+def get_posts_for_page(base_url, page, headers, session=None):
     url = base_url + str(page)
-    response = requests.get(url, headers=headers)
+    response = (session or get_session()).get(url, headers=headers)
     response.raise_for_status()
     json_data = response.json()
-    return json_data.get("data", [])
+    return json_data.get("data") or []
+
+def find_last_page(session: requests.Session, base_url: str, headers: dict, page_cache: Optional[Dict[int, List[Dict]]] = None) -> int:
+    """
+    Find the last non-empty page with an exponential probe followed by a binary
+    search. Probed pages are kept in page_cache so they are not fetched twice.
+    """
+    if page_cache is None:
+        page_cache = {}
+
+    def has_posts(page):
+        if page not in page_cache:
+            page_cache[page] = get_posts_for_page(base_url, page, headers, session)
+        return bool(page_cache[page])
+
+    if not has_posts(1):
+        return 0
+
+    min_page, max_page = 1, 2
+    while has_posts(max_page):
+        min_page, max_page = max_page, max_page * 2
+
+    # Back track between the last full and the first empty page
+    while min_page + 1 < max_page:
+        mid = (min_page + max_page + 1) // 2
+        if has_posts(mid):
+            min_page = mid
+        else:
+            max_page = mid
+    return min_page
+
+def iter_pages_concurrently(session: requests.Session, base_url: str, last_page: int, headers: dict, label: str, kind: Optional[str] = None, progress_queue=None, page_cache: Optional[Dict[int, List[Dict]]] = None, failed_pages: Optional[List[int]] = None, max_retries: int = 3, retry_delay: int = 2):
+    """
+    Fetch pages 1..last_page through a bounded pool and yield each page's posts
+    in page order as soon as it and every page before it are in. Pages that
+    still fail after retries are appended to failed_pages instead of ending
+    the listing.
+    """
+    page_threads = int(os.getenv('PAGE_FETCH_THREADS', '5'))
+    page_cache = dict(page_cache or {})
+    if failed_pages is None:
+        failed_pages = []
+
+    def fetch_page(page):
+        if page_cache.get(page):
+            return page_cache[page]
+        for attempt in range(max_retries):
+            try:
+                return get_posts_for_page(base_url, page, headers, session)
+            except (requests.RequestException, ValueError) as e:
+                thread_safe_log('warning', f"Error fetching page {page} of {label} (attempt {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    time.sleep(retry_delay)
+        return None
+
+    thread_safe_log('info', f"Fetching {last_page} pages of {label} with {page_threads} parallel threads", progress_queue)
+    done_pages = {}
+    next_page = 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=page_threads) as executor:
+        futures = {executor.submit(fetch_page, page): page for page in range(1, last_page + 1)}
+        for future in concurrent.futures.as_completed(futures):
+            page = futures[future]
+            page_posts = future.result()
+            if page_posts is None:
+                failed_pages.append(page)
+                thread_safe_log('error', f"Giving up on page {page} of {label}", progress_queue)
+            else:
+                matching = [post for post in page_posts if not kind or post.get("kind") == kind]
+                thread_safe_log('info', f"Found {len(matching)} {kind or 'post'}s on page {page} of {label}", progress_queue)
+            done_pages[page] = page_posts
+
+            while next_page in done_pages:
+                page_posts = done_pages.pop(next_page)
+                next_page += 1
+                if page_posts:
+                    yield page_posts
+
+def iter_pages_until_known(session: requests.Session, base_url: str, headers: dict, label: str, kind: Optional[str], known_ids: set, progress_queue=None):
+    """
+    Yield pages one by one until reaching posts that were already synced.
+    Returns whether the listing caught up (via StopIteration / yield from).
+    """
+    page = 1
+    while True:
+        try:
+            thread_safe_log('info', f"Fetching page {page} of {label}...", progress_queue)
+            page_posts = get_posts_for_page(base_url, page, headers, session)
+        except (requests.RequestException, ValueError) as e:
+            thread_safe_log('error', f"Error fetching page {page} of {label}: {e}", progress_queue)
+            return False
 
-def verify_video_file(file_path: str) -> bool:
-    """Verify if a video file is valid"""
+        if not page_posts:
+            thread_safe_log('info', f"No more {label} found", progress_queue)
+            return True
+
+        matching = [post for post in page_posts if not kind or post.get("kind") == kind]
+        thread_safe_log('info', f"Found {len(matching)} {kind or 'post'}s on page {page} of {label}", progress_queue)
+        yield page_posts
+
+        # Pinned posts may be known while the rest of the page is new, so only
+        # the oldest entry on the page decides whether we caught up
+        if str(page_posts[-1].get("id")) in known_ids:
+            new_posts = len([post for post in page_posts if str(post.get("id")) not in known_ids])
+            thread_safe_log('info', f"Reached already synced {label} on page {page} ({new_posts} new on this page)", progress_queue)
+            return True
+
+        page += 1
+
+def iter_full_listing(session: requests.Session, base_url: str, headers: dict, label: str, kind: Optional[str], progress_queue=None):
+    """
+    Probe the page count, then yield every page fetched concurrently.
+    Returns whether all pages were fetched (via StopIteration / yield from).
+    """
+    page_cache = {}
     try:
-        result = subprocess.run(
-            ["ffprobe", "-v", "error", file_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        return result.returncode == 0
+        last_page = find_last_page(session, base_url, headers, page_cache)
+    except (requests.RequestException, ValueError) as e:
+        thread_safe_log('error', f"Error probing page count of {label}: {e}", progress_queue)
+        return False
+
+    failed_pages = []
+    yield from iter_pages_concurrently(session, base_url, last_page, headers, label, kind,
+                                       progress_queue, page_cache, failed_pages)
+    if failed_pages:
+        thread_safe_log('error', f"Failed to fetch pages {sorted(failed_pages)} of {label}", progress_queue)
+        return False
+    thread_safe_log('info', f"No more {label} found", progress_queue)
+    return True
+
+def iter_user_posts(session: requests.Session, user_id, feed: str = 'posts', kind: Optional[str] = None, progress_queue=None, catalog: Optional[PostCatalog] = None, headers: Optional[dict] = None):
+    """
+    Yield a creator's posts from a feed ('posts' or 'back_number_posts') while
+    pages are still being fetched.
+    With a catalog that holds a complete earlier sync, paging stops at the first
+    page whose oldest post is already known and the rest is served from disk.
+    Otherwise the page count is probed first and all pages are fetched concurrently.
+    """
+    if headers is None:
+        headers = read_headers_from_file("header.txt")
+    base_url = f"https://api.myfans.jp/api/v2/users/{user_id}/{feed}?page="
+    label = "regular posts" if feed == 'posts' else "back plan posts"
+    incremental = catalog is not None and catalog.is_complete(user_id, feed)
+
+    if incremental:
+        pages = iter_pages_until_known(session, base_url, headers, label, kind,
+                                       catalog.known_post_ids(user_id, feed), progress_queue)
+    else:
+        pages = iter_full_listing(session, base_url, headers, label, kind, progress_queue)
+
+    seen_ids = set()
+    while True:
+        try:
+            page_posts = next(pages)
+        except StopIteration as stop:
+            complete = bool(stop.value)
+            break
+        if catalog is not None:
+            catalog.add_posts(user_id, feed, page_posts)
+        for post in page_posts:
+            seen_ids.add(str(post.get("id")))
+            if not kind or post.get("kind") == kind:
+                yield post
+
+    if catalog is None:
+        return
+
+    catalog.mark_synced(user_id, feed, complete)
+    # Serve everything older than the caught-up point straight from the catalog
+    for post in catalog.get_posts(user_id, feed, kind):
+        if str(post.get("id")) not in seen_ids:
+            yield post
+
+def list_user_posts(session: requests.Session, user_id, feed: str = 'posts', kind: Optional[str] = None, progress_queue=None, catalog: Optional[PostCatalog] = None, headers: Optional[dict] = None) -> List[Dict]:
+    """Return all posts of a creator's feed, see iter_user_posts"""
+    return list(iter_user_posts(session, user_id, feed, kind, progress_queue, catalog, headers))
+
+def filter_posts_by_type(posts, download_type: str):
+    """Lazily apply the 'free' / 'subscribed' / 'all' download filter"""
+    for post in posts:
+        if download_type == 'free' and not post.get("free"):
+            continue
+        if download_type == 'subscribed' and post.get("free"):
+            continue
+        yield post
+
+def has_video_urls(post: Dict) -> bool:
+    """True when the post already carries every main video variant URL and its access flags"""
+    main_videos = post.get('videos', {}).get('main') or []
+    return bool(main_videos) and all(video.get('url') for video in main_videos) and 'subscribed' in post
+
+def post_image_urls(post: Dict) -> Optional[List[str]]:
+    """Image URLs from a detail ('images') or listing ('post_images') payload, None if neither is present"""
+    if post.get('images'):
+        return [image.get('url') for image in post['images']]
+    if post.get('post_images'):
+        return [image.get('file_url') for image in post['post_images']]
+    return None
+
+def needs_video_details(post: Dict) -> bool:
+    return not has_video_urls(post)
+
+def needs_image_details(post: Dict) -> bool:
+    return post_image_urls(post) is None or 'user' not in post
+
+def resolve_post(session: requests.Session, post_id, headers: Optional[dict], post: Optional[Dict], needs_detail) -> Dict:
+    """Return the post payload, fetching /posts/{id} only when the given one is missing or incomplete"""
+    if post is not None and not needs_detail(post):
+        return post
+    response = session.get(f"https://api.myfans.jp/api/v2/posts/{post_id}", headers=headers)
+    response.raise_for_status()
+    return {**(post or {}), **response.json()}
+
+def with_post_details(session: requests.Session, posts, needs_detail, headers: Optional[dict] = None, progress_queue=None):
+    """
+    Yield listing posts in order, fetching /posts/{id} only for those where
+    needs_detail(post) is true. Detail requests run DETAIL_FETCH_THREADS at a
+    time over a sliding window, and their payload is merged over the listing one.
+    """
+    workers = max(1, int(os.getenv('DETAIL_FETCH_THREADS', '4')))
+    window = workers * 2
+
+    def fetch_detail(post):
+        try:
+            return resolve_post(session, post['id'], headers, post, needs_detail)
+        except requests.RequestException as e:
+            thread_safe_log('error', f"Failed to fetch details for post {post.get('id')}: {e}", progress_queue)
+            return post
+
+    pending = deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='post-detail') as executor:
+        for post in posts:
+            if post.get('id') and needs_detail(post):
+                pending.append(executor.submit(fetch_detail, post))
+            else:
+                pending.append(post)
+            while pending and (len(pending) >= window or not isinstance(pending[0], concurrent.futures.Future)
+                               or pending[0].done()):
+                head = pending.popleft()
+                yield head.result() if isinstance(head, concurrent.futures.Future) else head
+        while pending:
+            head = pending.popleft()
+            yield head.result() if isinstance(head, concurrent.futures.Future) else head
+
+def probe_video_file(file_path: str) -> Tuple[bool, Optional[float]]:
+    """Run ffprobe on a file, returning whether it is readable and its container duration"""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+         "-of", "default=noprint_wrappers=1:nokey=1", file_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    try:
+        duration = float(result.stdout.decode(errors='replace').strip().splitlines()[0])
+    except (IndexError, ValueError):
+        duration = None
+    return result.returncode == 0, duration
+
+def post_video_duration(post: Dict) -> Optional[float]:
+    """Duration reported by the API for a post's main video, if the payload has one"""
+    for video in post.get('videos', {}).get('main') or []:
+        if video.get('duration'):
+            return video['duration']
+    return None
+
+def verify_video_file(file_path: str, expected_duration: Optional[float] = None) -> bool:
+    """
+    Verify if a video file is valid, trusting the cached verdict while the file
+    is unchanged. New files get an in-process MP4 box check first and ffprobe
+    only runs when that check is inconclusive. A failing cache never decides
+    the verdict, the file is then checked as if it were uncached.
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError as e:
+        logger.error(f"Error verifying video file {file_path}: {e}")
+        return False
+
+    index = None
+    try:
+        index = get_verification_index()
+        cached = index.lookup(file_path, st)
+        if cached is not None:
+            return cached[0]
+    except Exception as e:
+        logger.warning(f"Verification cache unavailable for {file_path}, checking the file: {e}")
+
+    try:
+        check = check_mp4(file_path, expected_duration)
+        if check.verdict is not None:
+            if not check.verdict:
+                logger.warning(f"MP4 structure check failed for {file_path}: {check.reason}")
+            valid, duration = check.verdict, check.duration
+        else:
+            logger.debug(f"MP4 structure check inconclusive for {file_path} ({check.reason}), running ffprobe")
+            valid, duration = probe_video_file(file_path)
     except Exception as e:
         logger.error(f"Error verifying video file {file_path}: {e}")
         return False
 
+    if index is not None:
+        try:
+            index.store(file_path, st, valid, duration)
+        except Exception as e:
+            logger.warning(f"Could not cache verification result for {file_path}: {e}")
+    return valid
+
 def safe_urljoin(base: str, url: str) -> str:
     """Safely join URL parts ensuring no None values"""
     if not base or not url:
         raise ValueError("Base URL and URL parts must not be None")
     return urljoin(base, url)
 
-def make_request(session: requests.Session, url: str, headers: dict, timeout: int = 30) -> requests.Response:
+def make_request(session: requests.Session, url: str, headers: dict, timeout: float = 30) -> requests.Response:
     """Make a request ensuring proper type safety"""
     if not url:
         raise ValueError("URL cannot be None")
     return session.get(url, headers=headers, timeout=timeout)
 
-def DL_File(m3u8_url_download, output_file, input_post_id, chunk_size=1024*1024, max_retries=3, retry_delay=5, progress_queue=None, download_state=None):
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+_chunk_buffers = threading.local()
+
+def chunk_buffer(chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> memoryview:
+    """Per-thread reusable buffer so streaming copies do not allocate per chunk"""
+    buffer = getattr(_chunk_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != chunk_size:
+        buffer = _chunk_buffers.buffer = bytearray(chunk_size)
+    return memoryview(buffer)
+
+def stream_response_to_file(response: requests.Response, path: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE, progress_callback=None, validator: Optional[TsValidator] = None) -> Tuple[int, int]:
+    """
+    Copy a response opened with stream=True to path in fixed-size chunks, so
+    memory stays bounded by chunk_size. Returns (size, crc32) of the body.
+    A validator sees every chunk as it arrives and may abort the copy.
+    """
+    view = chunk_buffer(chunk_size)
+    raw = response.raw
+    raw.decode_content = True
+    size = 0
+    crc = 0
+    with open(path, 'wb') as f:
+        while True:
+            n = raw.readinto(view)
+            if not n:
+                break
+            chunk = view[:n]
+            if validator:
+                validator.feed(chunk)
+            f.write(chunk)
+            crc = zlib.crc32(chunk, crc)
+            size += n
+            if progress_callback:
+                progress_callback(n)
+    return size, crc
+
+def download_to_file(session: requests.Session, url: str, path: str, headers: Optional[dict] = None, timeout: float = 30, progress_callback=None) -> Tuple[int, int]:
+    """
+    Stream url to path through a .part file so an interrupted download never
+    looks complete. Returns (size, crc32) of the body.
+    """
+    part_path = f"{path}.{threading.get_ident()}.part"
+    try:
+        with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            size, crc = stream_response_to_file(response, part_path, progress_callback=progress_callback)
+        os.replace(part_path, path)
+        return size, crc
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+def dedupe_download(path: str, crc: Optional[int] = None, progress_queue=None, post: Optional[Dict] = None):
+    """
+    Replace a finished download by a link to identical content already on disk
+    (DEDUPE=1). The post's date decides whether a hardlink is acceptable.
+    """
+    if not int(os.getenv('DEDUPE', '1')):
+        return
+    date_obj = get_post_date(post) if post else None
+    try:
+        saved, original = get_content_index().link_duplicate(path, crc, date_obj.timestamp() if date_obj else None)
+    except Exception as e:
+        logger.warning(f"Deduplication failed for {path}: {e}")
+        return
+    if saved:
+        thread_safe_log('info', f"{os.path.basename(path)} duplicates {os.path.basename(original)}, "
+                                f"linked instead of storing {saved / 1048576:.1f} MB again", progress_queue)
+
+def index_download(path: str):
+    """Record a finished download in the file index; a failing index never fails the download"""
+    try:
+        get_file_index().add(path)
+    except Exception as e:
+        logger.warning(f"Could not add {path} to the file index: {e}")
+
+def report_dedupe_savings(progress_queue=None):
+    index = get_content_index()
+    if index.linked_files:
+        thread_safe_log('info', f"Deduplication saved {index.saved_bytes / 1048576:.1f} MB "
+                                f"across {index.linked_files} files", progress_queue)
+
+class SegmentReorderBuffer:
+    """Bounded buffer that hands downloaded segments back in playlist order"""
+
+    def __init__(self, total: int, capacity: int, on_advance=None):
+        self.total = total
+        self.capacity = max(1, capacity)
+        self.next_index = 0
+        self.pending = {}
+        self.closed = False
+        self.on_advance = on_advance
+        self.cond = threading.Condition()
+
+    def accepts(self, index: int) -> bool:
+        """Whether a segment may start without running too far ahead of the writer"""
+        return index < self.next_index + self.capacity
+
+    def put(self, index: int, data: Optional[bytes]):
+        with self.cond:
+            if self.closed:
+                return
+            self.pending[index] = data
+            self.cond.notify_all()
+
+    def drain(self):
+        """Yield (index, data) in order; data is None for failed segments"""
+        while True:
+            with self.cond:
+                while (not self.closed and self.next_index < self.total
+                       and self.next_index not in self.pending):
+                    self.cond.wait()
+                if self.closed or self.next_index >= self.total:
+                    return
+                index = self.next_index
+                data = self.pending.pop(index)
+                self.next_index += 1
+            if self.on_advance:
+                self.on_advance()
+            yield index, data
+
+    def close(self):
+        """Stop accepting segments, e.g. when the consumer gives up"""
+        with self.cond:
+            self.closed = True
+            self.pending.clear()
+            self.cond.notify_all()
+
+def fetch_with_retries(attempt, index: int, retries: int = 3, retry_delay: int = 5):
+    """
+    Run a hedged segment attempt up to `retries` times, returning None if all fail.
+    A corrupt body is re-fetched right away, other errors wait retry_delay.
+    """
+    for seg_retry in range(retries):
+        try:
+            return segment_hedger.call(attempt, f"segment {index}")
+        except CorruptSegmentError as e:
+            logger.warning(f"Corrupt segment {index}, fetching again: {str(e)}")
+            continue
+        except Exception as e:
+            logger.error(f"Error downloading segment {index}: {str(e)}")
+        if seg_retry < retries - 1:
+            time.sleep(retry_delay)
+    return None
+
+def fetch_segment(session: requests.Session, seg_url: str, index: int, retries: int = 3, retry_delay: int = 5, check_sync: bool = True) -> Optional[bytes]:
+    """
+    Download a single segment into memory, returning None after the last retry.
+    Timeouts follow observed latency percentiles and straggling requests are
+    hedged with a duplicate request. Bodies are validated as MPEG-TS before
+    they are handed on.
+    """
+    def attempt(sent):
+        with segment_limiter.slot(seg_url) as probe:
+            sent.set()
+            started = time.monotonic()
+            response = make_request(session, seg_url, None, timeout=segment_latency.timeout())
+            response.raise_for_status()
+            probe.bytes = len(response.content)
+        validator = TsValidator(check_sync)
+        validator.feed(response.content)
+        validator.finish(expected_body_length(response))
+        segment_latency.record(time.monotonic() - started)
+        return response.content
+
+    return fetch_with_retries(attempt, index, retries, retry_delay)
+
+def fetch_segment_to_file(session: requests.Session, seg_url: str, index: int, seg_path: str, retries: int = 3, retry_delay: int = 5, check_sync: bool = True) -> Optional[Tuple[int, int]]:
+    """
+    Stream a single segment to seg_path in fixed-size chunks, returning its
+    (size, crc32) or None after the last retry. Each attempt writes its own
+    .part file, so a hedged duplicate never clobbers the winner. Chunks are
+    validated as MPEG-TS while they arrive.
+    """
+    def attempt(sent):
+        part_path = f"{seg_path}.{threading.get_ident()}.part"
+        try:
+            with segment_limiter.slot(seg_url) as probe:
+                sent.set()
+                def on_chunk(n):
+                    probe.bytes += n
+
+                started = time.monotonic()
+                with session.get(seg_url, timeout=segment_latency.timeout(), stream=True) as response:
+                    response.raise_for_status()
+                    validator = TsValidator(check_sync)
+                    size, crc = stream_response_to_file(response, part_path, progress_callback=on_chunk,
+                                                        validator=validator)
+                    validator.finish(expected_body_length(response))
+        except Exception:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        segment_latency.record(time.monotonic() - started)
+        return part_path, size, crc
+
+    result = fetch_with_retries(attempt, index, retries, retry_delay)
+    if result is None:
+        return None
+    part_path, size, crc = result
+    os.replace(part_path, seg_path)
+    return size, crc
+
+def segment_url(playlist: m3u8.M3U8, segment) -> str:
+    """Resolve a segment URI against its variant playlist"""
+    if segment_uri_is_absolute(segment.uri):
+        return segment.uri
+    return safe_urljoin(playlist.base_uri, segment.uri)
+
+def stream_segments_to_ffmpeg(session: requests.Session, playlist: m3u8.M3U8, output_file: str, input_post_id, segment_threads: int, retry_delay: int = 5, progress_queue=None) -> bool:
+    """
+    Download segments concurrently and pipe them into ffmpeg's stdin in playlist
+    order, so the MP4 is remuxed while the download is still running.
+    """
+    total_segments = len(playlist.segments)
+    reorder = SegmentReorderBuffer(total_segments, segment_threads * 2, on_advance=segment_scheduler.notify)
+
+    process = subprocess.Popen(
+        ["ffmpeg", "-y", "-loglevel", "error", "-f", "mpegts", "-i", "pipe:0", "-c", "copy", output_file],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    # Drain stderr in the background so a chatty ffmpeg never blocks on a full pipe
+    stderr_lines = []
+    stderr_thread = threading.Thread(
+        target=lambda: stderr_lines.extend(process.stderr.read().decode(errors='replace').splitlines()),
+        daemon=True
+    )
+    stderr_thread.start()
+
+    def download_segment(i, segment):
+        data = None
+        try:
+            if segment.uri:
+                data = fetch_segment(session, segment_url(playlist, segment), i, retry_delay=retry_delay,
+                                     check_sync=segment_is_plain(segment))
+            else:
+                logger.error(f"Invalid segment {i}: missing URI")
+        finally:
+            reorder.put(i, data)
+
+    written = 0
+    failed = 0
+    processed_count = 0
+    pipe_broken = False
+    with tqdm(total=total_segments, desc=f"Segments for {input_post_id}") as pbar:
+        # Segments run on the shared scheduler; the reorder window keeps this
+        # video from running too far ahead of what ffmpeg has consumed
+        job = segment_scheduler.submit(
+            [functools.partial(download_segment, i, segment) for i, segment in enumerate(playlist.segments)],
+            ready=reorder.accepts
+        )
+        try:
+            for idx, data in reorder.drain():
+                processed_count += 1
+                pbar.update(1)
+                if data is None:
+                    failed += 1
+                    if failed > total_segments * 0.1:
+                        logger.error(f"Too many failed segments for post {input_post_id}, aborting stream")
+                        break
+                else:
+                    process.stdin.write(data)
+                    written += 1
+
+                if processed_count % 50 == 0 or processed_count == total_segments:
+                    success_rate = written / processed_count * 100
+                    thread_safe_log('info', f"Progress: {processed_count}/{total_segments} segments ({success_rate:.1f}% success)", progress_queue)
+        except BrokenPipeError:
+            pipe_broken = True
+            logger.error(f"FFmpeg closed its input early for post {input_post_id}")
+        finally:
+            reorder.close()
+            job.cancel()
+            job.wait()
+
+    try:
+        process.stdin.close()
+    except BrokenPipeError:
+        pipe_broken = True
+    returncode = process.wait()
+    stderr_thread.join(timeout=5)
+
+    success_rate = written / total_segments * 100 if total_segments else 0
+    thread_safe_log('info', f"Downloaded {written}/{total_segments} segments ({success_rate:.1f}% success)", progress_queue)
+
+    if written < total_segments * 0.9 or pipe_broken or returncode != 0:
+        if returncode != 0:
+            logger.error(f"FFmpeg error: {' '.join(stderr_lines[-5:])}")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        return False
+    return True
+
+# Kernel copy paths that turned out to be unsupported on this system
+_zero_copy_support = {'copy_file_range': hasattr(os, 'copy_file_range'), 'sendfile': hasattr(os, 'sendfile')}
+_ZERO_COPY_FALLBACK_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+def copy_file_into(infile, outfile, size: int):
+    """
+    Append an open file to another without passing the bytes through Python:
+    copy_file_range first, then sendfile, then chunked readinto through the
+    reusable buffer. Both files must be unbuffered.
+    """
+    in_fd, out_fd = infile.fileno(), outfile.fileno()
+    offset = 0
+
+    if _zero_copy_support['copy_file_range']:
+        try:
+            while offset < size:
+                copied = os.copy_file_range(in_fd, out_fd, size - offset, offset)
+                if not copied:
+                    break
+                offset += copied
+        except OSError as e:
+            if e.errno not in _ZERO_COPY_FALLBACK_ERRNOS:
+                raise
+            _zero_copy_support['copy_file_range'] = False
+
+    if offset < size and _zero_copy_support['sendfile']:
+        try:
+            while offset < size:
+                sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+                if not sent:
+                    break
+                offset += sent
+        except OSError as e:
+            if e.errno not in _ZERO_COPY_FALLBACK_ERRNOS:
+                raise
+            _zero_copy_support['sendfile'] = False
+
+    if offset < size:
+        view = chunk_buffer()
+        infile.seek(offset)
+        while True:
+            n = infile.readinto(view)
+            if not n:
+                break
+            outfile.write(view[:n])
+
+def concat_files(paths: List[str], out_path: str):
+    """Concatenate files into out_path using kernel-side copies where available"""
+    with open(out_path, 'wb', buffering=0) as outfile:
+        for path in paths:
+            with open(path, 'rb', buffering=0) as infile:
+                copy_file_into(infile, outfile, os.fstat(infile.fileno()).st_size)
+
+SPOOL_SUFFIX = '.ts_parts'
+SPOOL_NAME_RE = re.compile(r'^[^/]+_[0-9a-f]{12}\.ts(_parts)?$')
+LEGACY_SPOOL_NAME_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.ts(_parts)?$')
+
+def spool_name(input_post_id, variant_url: str) -> str:
+    """Deterministic spool name for a post/variant, stable across signed URL changes"""
+    variant_key = hashlib.sha1(urlparse(variant_url).path.encode()).hexdigest()[:12]
+    return f"{input_post_id}_{variant_key}"
+
+class SegmentManifest:
+    """Append-only record of finished spool segments (index, size, crc32) for resuming"""
+
+    def __init__(self, temp_folder: str, total_segments: int):
+        self.path = os.path.join(temp_folder, 'manifest.jsonl')
+        self.total_segments = total_segments
+        self.entries = {}
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            self._reset()
+            return
+        try:
+            with open(self.path, 'r') as f:
+                header = json.loads(f.readline())
+                if header.get('total_segments') != self.total_segments:
+                    logger.warning(f"Spool manifest does not match playlist, starting over: {self.path}")
+                    self._reset()
+                    return
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # torn final line from an interrupted run
+                    self.entries[entry['index']] = entry
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Unreadable spool manifest {self.path} ({e}), starting over")
+            self._reset()
+
+    def _reset(self):
+        self.entries = {}
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({'total_segments': self.total_segments}) + '\n')
+
+    def verified_path(self, index: int, seg_path: str) -> Optional[str]:
+        """Return seg_path if the manifest says it is complete and the file still matches"""
+        entry = self.entries.get(index)
+        if not entry or not os.path.exists(seg_path) or os.path.getsize(seg_path) != entry['size']:
+            return None
+        if file_crc32(seg_path) != entry['crc32']:
+            return None
+        return seg_path
+
+    def record(self, index: int, size: int, crc: int):
+        entry = {'index': index, 'size': size, 'crc32': crc}
+        with self.lock:
+            self.entries[index] = entry
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+def cleanup_orphaned_spools(downloads_dir: str, max_age_days: Optional[float] = None) -> int:
+    """
+    Remove spool folders that can no longer be resumed: legacy random-named
+    ones and deterministic ones untouched for SPOOL_MAX_AGE_DAYS.
+    Only <downloads>/<creator>/videos is scanned.
+    """
+    if max_age_days is None:
+        max_age_days = float(os.getenv('SPOOL_MAX_AGE_DAYS', '7'))
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    if not os.path.isdir(downloads_dir):
+        return removed
+
+    for creator in os.scandir(downloads_dir):
+        videos_dir = os.path.join(creator.path, 'videos')
+        if not creator.is_dir() or not os.path.isdir(videos_dir):
+            continue
+        for entry in os.scandir(videos_dir):
+            try:
+                if entry.is_dir() and entry.name.endswith(SPOOL_SUFFIX):
+                    if SPOOL_NAME_RE.match(entry.name) and entry.stat().st_mtime >= cutoff:
+                        continue
+                    shutil.rmtree(entry.path)
+                    removed += 1
+                elif entry.is_file() and entry.name.endswith('.ts') and (
+                        LEGACY_SPOOL_NAME_RE.match(entry.name)
+                        or (SPOOL_NAME_RE.match(entry.name) and not os.path.isdir(entry.path + '_parts'))):
+                    # Merged .ts left behind by an interrupted remux
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"Could not remove orphaned spool {entry.path}: {e}")
+
+    if removed:
+        logger.info(f"Removed {removed} orphaned segment spools from {downloads_dir}")
+    return removed
+
+def spool_and_merge_segments(session: requests.Session, playlist: m3u8.M3U8, output_file: str, input_post_id, segment_threads: int, retry_delay: int = 5, progress_queue=None, variant_url: Optional[str] = None) -> bool:
+    """
+    Download segments to a per post/variant temp folder, concatenate them and
+    remux with ffmpeg. Finished segments are recorded in a manifest so an
+    interrupted run resumes at the first missing segment.
+    """
+    output_folder = os.path.dirname(output_file)
+    name = spool_name(input_post_id, variant_url or playlist.base_uri)
+    ts_file = os.path.join(output_folder, name + '.ts')
+    temp_folder = os.path.join(output_folder, name + SPOOL_SUFFIX)
+    os.makedirs(temp_folder, exist_ok=True)
+    manifest = SegmentManifest(temp_folder, len(playlist.segments))
+    if manifest.entries:
+        thread_safe_log('info', f"Resuming post {input_post_id} with {len(manifest.entries)} segments already downloaded", progress_queue)
+
+    total_segments = len(playlist.segments)
+    segment_files = [None] * total_segments  # Pre-allocate list with correct order
+    processed_count = 0
+    progress_lock = threading.Lock()
+
+    def fetch_to_file(i, segment):
+        if not segment.uri:
+            logger.error(f"Invalid segment {i}: missing URI")
+            return None
+
+        seg_path = os.path.join(temp_folder, f"segment_{i:05d}.ts")
+
+        # Skip segments a previous run finished
+        if manifest.verified_path(i, seg_path):
+            return seg_path
+
+        # Streamed to a .part file and renamed, so a crash never leaves a partial segment in place
+        result = fetch_segment_to_file(session, segment_url(playlist, segment), i, seg_path, retry_delay=retry_delay,
+                                       check_sync=segment_is_plain(segment))
+        if result is None:
+            return None
+        manifest.record(i, *result)
+        return seg_path
+
+    def download_segment(i, segment):
+        nonlocal processed_count
+        file_path = fetch_to_file(i, segment)
+        with progress_lock:
+            segment_files[i] = file_path
+            pbar.update(1)
+            processed_count += 1
+
+            # Log progress occasionally
+            if processed_count % 50 == 0 or processed_count == total_segments:
+                success_rate = len([f for f in segment_files if f]) / processed_count * 100
+                thread_safe_log('info', f"Progress: {processed_count}/{total_segments} segments ({success_rate:.1f}% success)", progress_queue)
+
+    # Segments run on the shared scheduler alongside other videos
+    with tqdm(total=total_segments, desc=f"Segments for {input_post_id}") as pbar:
+        job = segment_scheduler.submit(
+            [functools.partial(download_segment, i, segment) for i, segment in enumerate(playlist.segments)]
+        )
+        job.wait()
+
+    # Filter out None values (failed downloads)
+    valid_segments = [f for f in segment_files if f]
+    success_rate = len(valid_segments) / total_segments * 100
+    thread_safe_log('info', f"Downloaded {len(valid_segments)}/{total_segments} segments ({success_rate:.1f}% success)", progress_queue)
+
+    if len(valid_segments) < total_segments * 0.9:  # Less than 90% segments downloaded
+        logger.error(f"Too many failed segments: only {success_rate:.1f}% downloaded successfully")
+        return False
+
+    if os.getenv('SPOOL_MERGE', 'copy') == 'concat':
+        # Let ffmpeg read the segments directly, no intermediate .ts is written
+        thread_safe_log('info', "Converting to MP4 from segment list...", progress_queue)
+        concat_list = os.path.join(temp_folder, 'concat.txt')
+        with open(concat_list, 'w') as f:
+            for seg_file in valid_segments:
+                f.write(f"file '{os.path.basename(seg_file)}'\n")
+        ffmpeg_input = ["-f", "concat", "-safe", "0", "-i", concat_list]
+    else:
+        # Merge segments
+        thread_safe_log('info', "Merging segments...", progress_queue)
+        concat_files([f for f in valid_segments if os.path.exists(f)], ts_file)
+        thread_safe_log('info', "Converting to MP4...", progress_queue)
+        ffmpeg_input = ["-i", ts_file]
+
+    result = subprocess.run(
+        ["ffmpeg", "-y", *ffmpeg_input, "-c", "copy", output_file],
+        capture_output=True,
+        text=True
+    )
+
+    if result.returncode != 0:
+        logger.error(f"FFmpeg error: {result.stderr}")
+        return False
+
+    # Cleanup
+    try:
+        if os.path.exists(ts_file):
+            os.remove(ts_file)
+
+        # Remove segments, manifest and temp directory
+        if os.path.exists(temp_folder):
+            shutil.rmtree(temp_folder)
+    except Exception as e:
+        logger.warning(f"Error during cleanup: {str(e)}")
+    return True
+
+def DL_File(m3u8_url_download, output_file, input_post_id, chunk_size=1024*1024, max_retries=3, retry_delay=5, progress_queue=None, download_state=None, master_content=None, resolution=None, video_info=None):
     try:
         # Get segment download threads from environment or use default
         segment_threads = int(os.getenv('SEGMENT_DOWNLOAD_THREADS', '15'))
         logger.info(f"Using {segment_threads} threads for segment downloads")
-        
+
+        # Stream segments straight into ffmpeg unless the temp-folder workflow is requested
+        stream_remux = int(os.getenv('STREAM_REMUX', '1'))
+
+        # Report adaptive segment concurrency changes to the progress stream
+        segment_limiter.attach(progress_queue)
+
         # Add M3U8 URL validation
         if not m3u8_url_download:
             logger.error(f"Invalid M3U8 URL for post {input_post_id}")
@@ -127,7 +977,7 @@ def DL_File(m3u8_url_download, output_file, input_post_id, chunk_size=1024*1024,
 
         # Check if file already exists and is complete
         if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
-            if verify_video_file(output_file):
+            if verify_video_file(output_file, (video_info or {}).get('duration')):
                 message = f"Verified existing file: {os.path.basename(output_file)}"
                 logger.info(message)
                 if progress_queue:
@@ -144,32 +994,26 @@ def DL_File(m3u8_url_download, output_file, input_post_id, chunk_size=1024*1024,
 
         # Setup directories
         output_folder = os.path.dirname(output_file)
-        random_name = str(uuid.uuid4())
-        ts_file =  os.path.join(output_folder, random_name + '.ts')
-        temp_folder = os.path.join(output_folder, random_name + '.ts_parts')
-
         os.makedirs(output_folder, exist_ok=True)
-        os.makedirs(temp_folder, exist_ok=True)
 
-        # Setup session with headers
-        headers = read_headers_from_file("header.txt")
-        session = requests.Session()
-        session.headers.update(headers)
-        
-        # Use connection pooling for better performance
-        adapter = requests.adapters.HTTPAdapter(pool_connections=segment_threads, 
-                                               pool_maxsize=segment_threads,
-                                               max_retries=max_retries)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
+        # Shared keep-alive session, sends the cached header.txt headers
+        session = get_session()
+
+        # Variant caps: requested resolution, MAX_VARIANT_BANDWIDTH and the creator's disk budget
+        max_height = RESOLUTION_HEIGHTS.get(resolution)
+        max_bandwidth = int(os.getenv('MAX_VARIANT_BANDWIDTH', '0'))
+        duration = (video_info or {}).get('duration') or 0
+        size_hint = (video_info or {}).get('size') or 0
+        reserved = 0
 
         for attempt in range(max_retries):
             try:
-                # Get master playlist
-                logger.info(f"Fetching master M3U8 from URL: {m3u8_url_download}")
-                response = session.get(m3u8_url_download, timeout=30)
-                response.raise_for_status()
-                master_content = response.text
+                # Get master playlist, reusing the preflight copy on the first attempt
+                if attempt > 0 or not master_content:
+                    logger.info(f"Fetching master M3U8 from URL: {m3u8_url_download}")
+                    response = session.get(m3u8_url_download, timeout=30)
+                    response.raise_for_status()
+                    master_content = response.text
 
                 # Parse master playlist
                 master_playlist = m3u8.loads(master_content)
@@ -179,12 +1023,25 @@ def DL_File(m3u8_url_download, output_file, input_post_id, chunk_size=1024*1024,
                     logger.error(f"No variants found in master playlist")
                     continue
 
-                # Get highest quality variant
-                variant = sorted(
-                    [p for p in master_playlist.playlists if p.stream_info and p.stream_info.bandwidth],
-                    key=lambda x: x.stream_info.bandwidth,
-                    reverse=True
-                )[0]
+                # Get the best variant within the resolution, bandwidth and disk budget caps
+                byte_limit = disk_budget.remaining(output_folder) if disk_budget.enabled else None
+                variant = select_variant(master_playlist.playlists, max_height, max_bandwidth,
+                                         byte_limit, duration, size_hint)
+                if variant is None:
+                    message = f"Skipping post {input_post_id}: no variant fits the remaining disk budget for {output_folder}"
+                    thread_safe_log('warning', message, progress_queue)
+                    return False
+                logger.info(f"Selected variant {variant.stream_info.resolution} at {variant.stream_info.bandwidth} bps for post {input_post_id}")
+
+                if disk_budget.enabled:
+                    top_bandwidth = max(p.stream_info.bandwidth for p in master_playlist.playlists
+                                        if p.stream_info and p.stream_info.bandwidth)
+                    estimate = estimate_variant_bytes(variant, top_bandwidth, duration, size_hint) or 0
+                    if not disk_budget.reserve(output_folder, estimate):
+                        message = f"Skipping post {input_post_id}: disk budget for {output_folder} is used up"
+                        thread_safe_log('warning', message, progress_queue)
+                        return False
+                    reserved = estimate
 
                 # Get variant playlist URL
                 base_uri = os.path.dirname(m3u8_url_download)
@@ -208,141 +1065,48 @@ def DL_File(m3u8_url_download, output_file, input_post_id, chunk_size=1024*1024,
 
                 total_segments = len(playlist.segments)
                 logger.info(f"Found {total_segments} segments for post {input_post_id}")
-                
-                if progress_queue:
-                    progress_queue.put(f"Downloading {total_segments} segments with {segment_threads} parallel threads")
 
-                # Download segments concurrently
-                segment_files = [None] * total_segments  # Pre-allocate list with correct order
-                processed_count = 0
-                
-                def download_segment(i, segment):
-                    nonlocal processed_count
-                    
-                    if not segment.uri:
-                        logger.error(f"Invalid segment {i}: missing URI")
-                        return i, None
-                        
-                    seg_path = os.path.join(temp_folder, f"segment_{i:05d}.ts")
-                    
-                    # Skip if segment already exists
-                    if os.path.exists(seg_path) and os.path.getsize(seg_path) > 0:
-                        return i, seg_path
-                        
-                    # Try to download segment with retries
-                    for seg_retry in range(3):
-                        try:
-                            seg_url = safe_urljoin(playlist.base_uri, segment.uri) if not segment_uri_is_absolute(segment.uri) else segment.uri
-                            response = session.get(seg_url, timeout=30)
-                            response.raise_for_status()
-
-                            with open(seg_path, 'wb') as f:
-                                f.write(response.content)
-
-                            if os.path.exists(seg_path) and os.path.getsize(seg_path) > 0:
-                                return i, seg_path
-                        except Exception as e:
-                            logger.error(f"Error downloading segment {i}: {str(e)}")
-                            if seg_retry == 2:  # Last attempt
-                                return i, None
-                            time.sleep(retry_delay)
-                    
-                    return i, None
-
-                # Use ThreadPoolExecutor for concurrent downloads
-                with tqdm(total=total_segments, desc=f"Segments for {input_post_id}") as pbar:
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=segment_threads) as executor:
-                        futures = {executor.submit(download_segment, i, segment): i 
-                                  for i, segment in enumerate(playlist.segments)}
-                        
-                        # Process completed downloads as they finish
-                        for future in concurrent.futures.as_completed(futures):
-                            try:
-                                idx, file_path = future.result()
-                                if file_path:
-                                    segment_files[idx] = file_path
-                                pbar.update(1)
-                                processed_count += 1
-                                
-                                # Log progress occasionally
-                                if processed_count % 50 == 0 or processed_count == total_segments:
-                                    success_rate = len([f for f in segment_files if f]) / processed_count * 100
-                                    thread_safe_log('info', f"Progress: {processed_count}/{total_segments} segments ({success_rate:.1f}% success)", progress_queue)
-                            except Exception as e:
-                                logger.error(f"Error processing segment result: {str(e)}")
-                
-                # Filter out None values (failed downloads)
-                valid_segments = [f for f in segment_files if f]
-                success_rate = len(valid_segments) / total_segments * 100
-                
-                logger.info(f"Downloaded {len(valid_segments)}/{total_segments} segments ({success_rate:.1f}% success)")
                 if progress_queue:
-                    progress_queue.put(f"Downloaded {len(valid_segments)}/{total_segments} segments ({success_rate:.1f}% success)")
+                    progress_queue.put(f"Downloading {total_segments} segments with {segment_scheduler.worker_count} shared segment workers")
 
-                if len(valid_segments) < total_segments * 0.9:  # Less than 90% segments downloaded
-                    logger.error(f"Too many failed segments: only {success_rate:.1f}% downloaded successfully")
+                if stream_remux:
+                    thread_safe_log('info', "Streaming segments into FFmpeg...", progress_queue)
+                    success = stream_segments_to_ffmpeg(session, playlist, output_file, input_post_id,
+                                                        segment_threads, retry_delay, progress_queue)
+                else:
+                    success = spool_and_merge_segments(session, playlist, output_file, input_post_id,
+                                                       segment_threads, retry_delay, progress_queue, variant_url)
+
+                if not success:
                     if attempt < max_retries - 1:  # Not the last attempt
                         logger.info(f"Retrying download, attempt {attempt + 2}/{max_retries}")
-                        continue
-
-                # Merge segments
-                logger.info("Merging segments...")
-                if progress_queue:
-                    progress_queue.put("Merging segments...")
-                
-                with open(ts_file, 'wb') as outfile:
-                    for seg_file in valid_segments:
-                        if os.path.exists(seg_file):
-                            with open(seg_file, 'rb') as infile:
-                                outfile.write(infile.read())
-
-                # Convert to MP4
-                logger.info("Converting to MP4...")
-                if progress_queue:
-                    progress_queue.put("Converting to MP4...")
-                
-                result = subprocess.run(
-                    ["ffmpeg", "-y", "-i", ts_file, "-c", "copy", output_file],
-                    capture_output=True,
-                    text=True
-                )
-
-                if result.returncode != 0:
-                    logger.error(f"FFmpeg error: {result.stderr}")
                     continue
 
                 # Verify final file
-                if verify_video_file(output_file):
-                    # Cleanup
-                    try:
-                        if os.path.exists(ts_file):
-                            os.remove(ts_file)
-                        
-                        # Delete segments
-                        for seg_file in valid_segments:
-                            if os.path.exists(seg_file):
-                                os.remove(seg_file)
-                                
-                        # Remove temp directory
-                        if os.path.exists(temp_folder):
-                            os.rmdir(temp_folder)
-                    except Exception as e:
-                        logger.warning(f"Error during cleanup: {str(e)}")
-                    
+                if verify_video_file(output_file, duration):
                     logger.info(f"Successfully downloaded {input_post_id}")
                     if progress_queue:
                         progress_queue.put(f"Successfully downloaded {input_post_id}")
-                    
+
+                    if reserved:
+                        disk_budget.settle(output_folder, reserved, os.path.getsize(output_file))
+                        reserved = 0
                     return True
 
             except Exception as e:
                 logger.error(f"Download attempt {attempt + 1} failed: {str(e)}")
                 if progress_queue:
                     progress_queue.put(f"Download attempt {attempt + 1} failed: {str(e)}")
-                
+
                 if attempt < max_retries - 1:
                     time.sleep(retry_delay)
 
+            finally:
+                # Give back the reservation of an attempt that did not produce a file
+                if reserved:
+                    disk_budget.settle(output_folder, reserved, 0)
+                    reserved = 0
+
         return False
 
     except Exception as e:
@@ -354,10 +1118,13 @@ def DL_File(m3u8_url_download, output_file, input_post_id, chunk_size=1024*1024,
 def segment_uri_is_absolute(uri: str) -> bool:
     return uri.lower().startswith(("http://", "https://"))
 
-def process_post_id(input_post_id, session, headers, selected_resolution, output_dir, filename_config, progress_bar=None, progress_queue=None):
+# Small pool for per-video preflight requests that overlap with local checks
+preflight_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='preflight')
+
+def process_post_id(input_post_id, session, headers, selected_resolution, output_dir, filename_config, progress_bar=None, progress_queue=None, post=None):
     try:
         # Use the passed session instead of creating new ones
-        data, resolution_info, error = get_video_info(input_post_id, session, headers)
+        data, resolution_info, error = get_video_info(input_post_id, session, headers, post)
         
         if error:
             message = f"Error fetching video info for post ID {input_post_id}: {error}"
@@ -396,8 +1163,8 @@ def process_post_id(input_post_id, session, headers, selected_resolution, output
             logger.warning(message)
             if progress_queue:
                 progress_queue.put(message)
-            # Try fallback
-            for res in ['uhd', 'fhd', 'hd', 'sd', 'ld']:
+            # Try fallback, preferring the nearest lower resolution
+            for res in fallback_resolutions(selected_resolution):
                 if res in resolution_info:
                     selected_resolution = res
                     message = f"Falling back to {res} resolution"
@@ -428,48 +1195,22 @@ def process_post_id(input_post_id, session, headers, selected_resolution, output
                 progress_queue.put(message)
             return False
 
-        # Validate URL before attempting download
-        if not validate_video_url(video_url, headers):
-            logger.error(f"Video URL validation failed for post {input_post_id}")
-            return False
-
-        # Log video URL (masked for security)
-        masked_url = video_url[:30] + "..." + video_url[-30:] if len(video_url) > 60 else video_url
-        logger.info(f"Video URL for post {input_post_id}: {masked_url}")
-
-        # Validate URL accessibility
-        try:
-            head_response = session.head(video_url)
-            head_response.raise_for_status()
-            logger.info(f"Video URL is accessible for post {input_post_id}")
-        except Exception as e:
-            logger.error(f"Video URL is not accessible for post {input_post_id}: {str(e)}")
-            return False
+        # Preflight: the master playlist GET doubles as the accessibility check
+        # and runs while the output path and any existing file are checked
+        preflight = preflight_executor.submit(fetch_master_playlist, session, video_url, headers)
 
         # Setup output path
         output_folder = str(os.path.join(output_dir, data['user']['username'], "videos"))
-        filename = None
-        full_path = None
-        for max_length in list(range(100, 10, -10)): # start at 100, decrease by 10.
-            try:
-                filename = generate_filename(data, filename_config, output_dir, max_length=max_length)
-                full_path = os.path.join(output_folder, filename)
-                path = pathlib.Path(str(full_path))
-                # if it already exists we can exit out
-                if path.exists():
-                    break
-                path.with_suffix('longextension') # to ensure metadata works (e.g. .webp.json)
-                # verify the path works by creating and deleting the file.
-                path.touch()
-                if path.exists():
-                    path.unlink()
-                    break
-            except Exception as e:
-                logger.debug(f"Invalid path with length {max_length} ({str(e)}), reducing...")
+        # Keep using a name written by an older version, otherwise take the fitted one
+        candidates = filename_candidates(data, filename_config, output_folder)
+        filename = next((name for name in candidates if os.path.exists(os.path.join(output_folder, name))),
+                        candidates[0])
+        full_path = os.path.join(output_folder, filename)
 
         # Check existing file
         if os.path.exists(full_path) and os.path.getsize(full_path) > 0:
-            if verify_video_file(full_path):
+            if verify_video_file(full_path, resolution_info[selected_resolution].get('duration')):
+                preflight.cancel()
                 generate_metadata(data, filename, output_folder)
                 update_file_date(data, full_path)
                 message = f"File already exists and verified: {filename}"
@@ -486,6 +1227,14 @@ def process_post_id(input_post_id, session, headers, selected_resolution, output
                     progress_queue.put(message)
                 os.remove(full_path)
 
+        master_content = preflight.result()
+        if master_content is None:
+            message = f"Video URL validation failed for post {input_post_id}"
+            logger.error(message)
+            if progress_queue:
+                progress_queue.put(message)
+            return False
+
         # Create output directory
         os.makedirs(output_folder, exist_ok=True)
 
@@ -499,10 +1248,15 @@ def process_post_id(input_post_id, session, headers, selected_resolution, output
             video_url,
             full_path,
             input_post_id,
-            progress_queue=progress_queue
+            progress_queue=progress_queue,
+            master_content=master_content,
+            resolution=selected_resolution,
+            video_info=resolution_info[selected_resolution]
         )
 
         if success:
+            dedupe_download(full_path, progress_queue=progress_queue, post=data)
+            index_download(full_path)
             generate_metadata(data, filename, output_folder)
             update_file_date(data, full_path)
             message = f"Successfully downloaded video: {filename}"
@@ -527,48 +1281,73 @@ def process_post_id(input_post_id, session, headers, selected_resolution, output
             progress_bar.update(1)
         return False
 
+def get_video_workers(config: Optional[configparser.ConfigParser] = None) -> int:
+    """Number of videos downloaded at once, from THREAD_COUNT or [Threads] threads"""
+    fallback = config.get('Threads', 'threads', fallback='10') if config else '10'
+    try:
+        return max(1, int(os.getenv('THREAD_COUNT', fallback)))
+    except ValueError:
+        logger.warning("Invalid THREAD_COUNT, using default value 10")
+        return 10
+
 def download_videos_concurrently(session, post_ids, selected_resolution, output_dir, filename_config, progress_queue=None, max_workers=3):
-    # Ändere max_workers auf 1 und stelle sicher, dass wir strikt sequentiell arbeiten
-    max_workers = 1  # Override to force sequential downloads
-    
     headers = read_headers_from_file("header.txt")
-    total_posts = len(post_ids)
-    message = f"Starting download of {total_posts} posts strictly one at a time..."
+    # post_ids may be a generator fed by the listing pipeline
+    total_posts = len(post_ids) if hasattr(post_ids, '__len__') else None
+    message = f"Starting download of {total_posts or 'listed'} posts with {max_workers} videos at a time..."
     logger.info(message)
     if progress_queue:
         progress_queue.put(message)
-    
+
     progress_bar = tqdm(total=total_posts, desc="Downloading videos", unit="video")
 
-    # Sequentieller Download statt ThreadPoolExecutor
-    for post_id in post_ids:
-        try:
+    # Segment fetches of all running videos share segment_limiter, so total
+    # load on a CDN host stays bounded no matter how many videos run at once
+    segment_limiter.attach(progress_queue)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+
+        def collect(done):
+            for future in done:
+                post_id = futures.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    error = f"Error processing post {post_id}: {e}"
+                    logger.error(error)
+                    if progress_queue:
+                        progress_queue.put(error)
+                progress_bar.update(1)
+
+        for item in post_ids:
+            # Items are post IDs or listing posts whose payload can be reused
+            post = item if isinstance(item, dict) else None
+            post_id = post.get('id') if post else item
             message = f"Processing post ID: {post_id}"
             logger.info(message)
             if progress_queue:
                 progress_queue.put(message)
-                
-            process_post_id(
+
+            futures[executor.submit(
+                process_post_id,
                 post_id,
                 session,
                 headers,
                 selected_resolution,
                 output_dir,
                 filename_config,
-                progress_bar,
-                progress_queue
-            )
-            
-            # Warte immer, bis ein Video fertig ist, bevor das nächste beginnt
-            time.sleep(1)  # Kleine Pause zwischen Videos
-            
-        except Exception as e:
-            error = f"Error processing post {post_id}: {e}"
-            logger.error(error)
-            if progress_queue:
-                progress_queue.put(error)
-        
-        progress_bar.update(1)
+                None,
+                progress_queue,
+                post
+            )] = post_id
+
+            # Only pull the next post once a worker is free, so post details
+            # (and their signed video URLs) are fetched just before use
+            if len(futures) >= max_workers:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                collect(done)
+
+        collect(concurrent.futures.as_completed(list(futures)))
 
     progress_bar.close()
     if progress_queue:
@@ -576,12 +1355,8 @@ def download_videos_concurrently(session, post_ids, selected_resolution, output_
 
 def download_single_file(session, post_id, selected_resolution, output_dir, filename_config):
     headers = read_headers_from_file("header.txt")
-    try:
-        response = session.get(f"https://api.myfans.jp/api/v2/posts/{post_id}", headers=headers)
-        response.raise_for_status()
-        process_post_id(post_id, session, headers, selected_resolution, output_dir, filename_config)
-    except requests.RequestException as e:
-        print(f"API request failed: {e}")
+    # process_post_id fetches the post itself, no separate existence request needed
+    process_post_id(post_id, session, headers, selected_resolution, output_dir, filename_config)
 
 def check_disk_space(path, required_bytes):
     """Check if there's enough disk space available"""
@@ -602,7 +1377,7 @@ def start_download(username, post_type, download_type, progress_queue, download_
             logger.info(message)
             progress_queue.put(message)
             
-            session = requests.Session()
+            session = get_session()
             config_file_path = os.path.join(os.getenv('CONFIG_DIR', ''), 'config.ini')
             
             config = configparser.ConfigParser()
@@ -623,7 +1398,7 @@ def start_download(username, post_type, download_type, progress_queue, download_
         logger.info(message)
         progress_queue.put(message)
         
-        session = requests.Session()
+        session = get_session()
         config_file_path = os.path.join(os.getenv('CONFIG_DIR', ''), 'config.ini')
         
         if not os.path.isfile(config_file_path):
@@ -668,162 +1443,67 @@ def start_download(username, post_type, download_type, progress_queue, download_
 
         # Process downloads based on type
         if post_type == 'videos':
-            # Fetch regular posts
-            base_url = f"https://api.myfans.jp/api/v2/users/{user_id}/posts?page="
-            progress_queue.put("Fetching regular posts...")
-            video_posts = []
-            page = 1
-            
-            while True:
-                try:
-                    message = f"Fetching page {page} of regular posts..."
-                    logger.info(message)
-                    progress_queue.put(message)
-                    
-                    response = session.get(base_url + str(page), headers=read_headers_from_file("header.txt"))
-                    response.raise_for_status()
-                    json_data = response.json()
-                    
-                    if not json_data.get("data") or len(json_data["data"]) == 0:
-                        message = "No more regular posts found"
-                        logger.info(message)
-                        progress_queue.put(message)
-                        break
-                        
-                    current_page_videos = [post for post in json_data["data"] if post.get("kind") == "video"]
-                    video_posts.extend(current_page_videos)
-                    
-                    message = f"Found {len(current_page_videos)} videos on page {page}"
+            catalog = PostCatalog()
+
+            def iter_video_posts():
+                # Fetch regular posts
+                progress_queue.put("Fetching regular posts...")
+                yield from iter_user_posts(session, user_id, 'posts', 'video', progress_queue, catalog)
+
+                # Fetch back number plan posts if available
+                if back_number_plan:
+                    message = "Starting to fetch back number plan posts..."
                     logger.info(message)
                     progress_queue.put(message)
-                    
-                    page += 1
-                    
-                except requests.RequestException as e:
-                    error = f"Error fetching page {page}: {e}"
-                    logger.error(error)
-                    progress_queue.put(error)
-                    break
+                    yield from iter_user_posts(session, user_id, 'back_number_posts', 'video', progress_queue, catalog)
 
-            # Fetch back number plan posts if available
-            if back_number_plan:
-                message = "Starting to fetch back number plan posts..."
-                logger.info(message)
-                progress_queue.put(message)
-                
-                back_plan_url = f"https://api.myfans.jp/api/v2/users/{user_id}/back_number_posts?page="
-                page = 1
-                
-                while True:
-                    try:
-                        message = f"Fetching back plan page {page}..."
-                        logger.info(message)
-                        progress_queue.put(message)
-                        
-                        response = session.get(back_plan_url + str(page), headers=read_headers_from_file("header.txt"))
-                        response.raise_for_status()
-                        json_data = response.json()
-                        
-                        if not json_data.get("data") or len(json_data["data"]) == 0:
-                            message = "No more back plan posts found"
-                            logger.info(message)
-                            progress_queue.put(message)
-                            break
-                            
-                        current_page_videos = [post for post in json_data["data"] if post.get("kind") == "video"]
-                        video_posts.extend(current_page_videos)
-                        
-                        message = f"Found {len(current_page_videos)} back plan videos on page {page}"
-                        logger.info(message)
-                        progress_queue.put(message)
-                        
-                        page += 1
-                        
-                    except requests.RequestException as e:
-                        error = f"Error fetching back plan page {page}: {e}"
-                        logger.error(error)
-                        progress_queue.put(error)
-                        break
-
-            message = f"Total video posts found: {len(video_posts)}"
+            try:
+                # Listing, existence check and downloads run as one pipeline so
+                # the first video starts while later pages are still loading
+                filtered_posts = filter_posts_by_type(iter_video_posts(), download_type)
+                stats = {'total': 0, 'existing': 0, 'missing': 0}
+                missing_files = iter_missing_posts(filtered_posts, output_dir, filename_config, stats, progress_queue)
+                # Listing posts lack the variant URLs, fetch details only for those actually downloaded
+                missing_files = with_post_details(session, missing_files, needs_video_details,
+                                                  progress_queue=progress_queue)
+                download_videos_concurrently(session, missing_files, resolution, output_dir, filename_config, progress_queue,
+                                             max_workers=get_video_workers(config))
+            finally:
+                catalog.close()
+
+            message = f"Total video posts found: {stats['total']}"
             logger.info(message)
             progress_queue.put(message)
 
-            # Filter posts based on download_type
-            if download_type == 'free':
-                filtered_posts = [post for post in video_posts if post.get("free")]
-            elif download_type == 'subscribed':
-                filtered_posts = [post for post in video_posts if not post.get("free")]
-            else:
-                filtered_posts = video_posts
-
-            # Check which files already exist
-            existing_files, missing_files = check_existing_files(filtered_posts, output_dir, filename_config)
-
-            message = f"Found {len(existing_files)} existing files, {len(missing_files)} files to download"
+            message = f"Found {stats['existing']} existing files, {stats['missing']} files downloaded"
             logger.info(message)
             progress_queue.put(message)
 
-            if missing_files:
-                message = f"Starting download of {len(missing_files)} missing files..."
-                logger.info(message)
-                progress_queue.put(message)
-                download_videos_concurrently(session, missing_files, resolution, output_dir, filename_config, progress_queue)
-            else:
+            if not stats['missing']:
                 message = "All files already downloaded!"
                 logger.info(message)
                 progress_queue.put(message)
 
+            report_dedupe_savings(progress_queue)
             progress_queue.put("DONE")
 
         elif post_type == 'images':
-            base_url = f"https://api.myfans.jp/api/v2/users/{user_id}/posts?page="
             progress_queue.put("Fetching image posts...")
-            image_posts = []
-            page = 1
-            
-            while True:
-                try:
-                    message = f"Fetching page {page} of image posts..."
-                    logger.info(message)
-                    progress_queue.put(message)
-                    
-                    response = session.get(base_url + str(page), headers=read_headers_from_file("header.txt"))
-                    response.raise_for_status()
-                    json_data = response.json()
-                    
-                    if not json_data.get("data"):
-                        break
-                        
-                    current_page_images = [post for post in json_data["data"] if post.get("kind") == "image"]
-                    image_posts.extend(current_page_images)
-                    
-                    message = f"Found {len(current_page_images)} images on page {page}"
-                    logger.info(message)
-                    progress_queue.put(message)
-                    
-                    page += 1
-                    
-                except requests.RequestException as e:
-                    error = f"Error fetching page {page}: {e}"
-                    logger.error(error)
-                    progress_queue.put(error)
-                    break
-
-            # Filter posts based on download_type
-            if download_type == 'free':
-                filtered_posts = [post for post in image_posts if post.get("free")]
-            elif download_type == 'subscribed':
-                filtered_posts = [post for post in image_posts if not post.get("free")]
-            else:
-                filtered_posts = image_posts
+            catalog = PostCatalog()
+            try:
+                image_posts = iter_user_posts(session, user_id, 'posts', 'image', progress_queue, catalog)
+                filtered_posts = filter_posts_by_type(image_posts, download_type)
 
-            message = f"Starting download of {len(filtered_posts)} filtered image posts..."
-            logger.info(message)
-            progress_queue.put(message)
+                message = "Starting download of filtered image posts as they are listed..."
+                logger.info(message)
+                progress_queue.put(message)
 
-            post_ids = [post.get("id") for post in filtered_posts]
-            download_images_concurrently(session, post_ids, output_dir, filename_config, progress_queue, download_state)
+                # Listing posts already carry their post_images, so details are rarely fetched
+                posts = with_post_details(session, filtered_posts, needs_image_details, progress_queue=progress_queue)
+                download_images_concurrently(session, posts, output_dir, filename_config, progress_queue, download_state)
+            finally:
+                catalog.close()
+            report_dedupe_savings(progress_queue)
 
         progress_queue.put("DONE")
         
@@ -835,14 +1515,18 @@ def start_download(username, post_type, download_type, progress_queue, download_
 
 def download_images_concurrently(session, post_ids, output_dir, filename_config, progress_queue=None, download_state=None, max_workers=1):
     headers = read_headers_from_file("header.txt")
-    total_posts = len(post_ids)
-    message = f"Starting download of {total_posts} image posts one at a time..."
+    # post_ids may be a generator fed by the listing pipeline
+    total_posts = len(post_ids) if hasattr(post_ids, '__len__') else None
+    message = f"Starting download of {total_posts or 'listed'} image posts one at a time..."
     if progress_queue:
         progress_queue.put(message)
     
     progress_bar = tqdm(total=total_posts, desc="Downloading images", unit="post")
 
-    def handle_image_download(input_post_id):
+    def handle_image_download(item):
+        # Items are post IDs or listing posts whose payload can be reused
+        post = item if isinstance(item, dict) else None
+        input_post_id = post.get('id') if post else item
         try:
             if download_state and download_state.is_completed(input_post_id):
                 message = f"Skipping already downloaded image post ID {input_post_id}"
@@ -852,12 +1536,9 @@ def download_images_concurrently(session, post_ids, output_dir, filename_config,
                 progress_bar.update(1)
                 return
 
-            url = f"https://api.myfans.jp/api/v2/posts/{input_post_id}"
-            response = session.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
+            data = resolve_post(session, input_post_id, headers, post, needs_image_details)
 
-            images = data.get('images', [])
+            images = post_image_urls(data) or []
             if not images:
                 error = f"No images found for post ID {input_post_id}"
                 logger.error(error)
@@ -872,8 +1553,7 @@ def download_images_concurrently(session, post_ids, output_dir, filename_config,
             output_folder = os.path.join(output_dir, name_creator, "images")
             os.makedirs(output_folder, exist_ok=True)
 
-            for idx, image in enumerate(images):
-                image_url = image.get('url')
+            for idx, image_url in enumerate(images):
                 if not image_url:
                     continue
 
@@ -889,16 +1569,14 @@ def download_images_concurrently(session, post_ids, output_dir, filename_config,
                     message = f"Image already exists: {file_name}"
                     logger.info(message)
                     update_file_date(data, full_path)
-                    generate_metadata(data, file_name, output_folder, ext)
+                    generate_metadata(data, file_name, output_folder, ext.replace('.', ''))
                     # if progress_queue:
                     #     progress_queue.put(message)
                     continue
 
-                img_response = session.get(image_url, headers=headers)
-                img_response.raise_for_status()
-
-                with open(full_path, 'wb') as f:
-                    f.write(img_response.content)
+                _, crc = download_to_file(session, image_url, full_path, headers)
+                dedupe_download(full_path, crc, progress_queue, data)
+                index_download(full_path)
 
                 generate_metadata(data, file_name, output_folder, ext.replace('.', ''))
                 update_file_date(data, full_path)
@@ -934,81 +1612,6 @@ def download_images_concurrently(session, post_ids, output_dir, filename_config,
     if progress_queue:
         progress_queue.put("Image download process completed")
 
-class DownloadState:
-    def __init__(self, state_dir="/config"):
-        self.state_file = os.path.join(state_dir, "download_state.json")
-        self.state = self._load_state()
-        self._cleanup_incomplete()
-
-    def _cleanup_incomplete(self):
-        """Check for incomplete downloads and mark them for retry"""
-        downloads_dir = os.getenv('DOWNLOADS_DIR', '/downloads')
-        for post_id, info in self.state["downloads"].items():
-            if info["status"] == "in_progress":
-                # Check if the download was interrupted
-                temp_folder = os.path.join(downloads_dir, f"{post_id}_parts")
-                if os.path.exists(temp_folder):
-                    self.state["downloads"][post_id]["status"] = "incomplete"
-                    self.state["downloads"][post_id]["segments_downloaded"] = len(
-                        [f for f in os.listdir(temp_folder) if f.endswith('.ts')]
-                    )
-        self.save_state()
-
-    def _load_state(self):
-        """Load download state from JSON file"""
-        try:
-            if os.path.exists(self.state_file):
-                with open(self.state_file, 'r') as f:
-                    return json.loads(f.read())
-            return {"completed_files": [], "downloads": {}}
-        except Exception as e:
-            logger.error(f"Error loading state file: {e}")
-            return {"completed_files": [], "downloads": {}}
-
-    def save_state(self):
-        """Save current state to JSON file"""
-        try:
-            with open(self.state_file, 'w') as f:
-                json.dump(self.state, f)
-        except Exception as e:
-            logger.error(f"Error saving state file: {e}")
-
-    def add_download(self, post_id, segments_total=0):
-        """Add new download to state"""
-        self.state["downloads"][str(post_id)] = {
-            "status": "in_progress",
-            "segments_total": segments_total,
-            "segments_downloaded": 0
-        }
-        self.save_state()
-
-    def update_progress(self, post_id, segments_done):
-        """Update download progress"""
-        if str(post_id) in self.state["downloads"]:
-            self.state["downloads"][str(post_id)]["segments_downloaded"] = segments_done
-            self.save_state()
-
-    def mark_completed(self, post_id):
-        """Mark download as completed"""
-        post_id = str(post_id)
-        if post_id not in self.state["completed_files"]:
-            self.state["completed_files"].append(post_id)
-        if post_id in self.state["downloads"]:
-            del self.state["downloads"][post_id]
-        self.save_state()
-
-    def mark_failed(self, post_id, error):
-        """Mark download as failed"""
-        self.state["downloads"][str(post_id)] = {
-            "status": "failed",
-            "error": error
-        }
-        self.save_state()
-
-    def is_completed(self, post_id):
-        """Check if download is already completed"""
-        return str(post_id) in self.state["completed_files"]
-
 def get_available_resolutions(main_videos):
     """Get all available resolutions from video data"""
     resolutions = {}
@@ -1029,13 +1632,17 @@ def get_available_resolutions(main_videos):
     resolutions['best'] = 'Best Available'
     return resolutions
 
-def get_video_info(input_post_id, session, headers):
+def get_video_info(input_post_id, session, headers, post=None):
     try:
-        url = f"https://api.myfans.jp/api/v2/posts/{input_post_id}"
-        response = session.get(url, headers=headers)
-        response.raise_for_status()
-        
-        data = response.json()
+        if post and has_video_urls(post):
+            # The listing/detail pipeline already resolved the variant URLs
+            data = post
+        else:
+            url = f"https://api.myfans.jp/api/v2/posts/{input_post_id}"
+            response = session.get(url, headers=headers)
+            response.raise_for_status()
+            data = response.json()
+
         main_videos = data.get('videos', {}).get('main', [])
         
         if not main_videos:
@@ -1065,15 +1672,12 @@ def get_video_info(input_post_id, session, headers):
         logger.error(f"Unexpected error for post {input_post_id}: {str(e)}")
         return None, None, str(e)
 
-def handle_image_download(post_id, session, headers, output_dir, filename_config, progress_queue=None):
+def handle_image_download(post_id, session, headers, output_dir, filename_config, progress_queue=None, post=None):
     """Handle downloading of a single image post"""
     try:
-        url = f"https://api.myfans.jp/api/v2/posts/{post_id}"
-        response = session.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+        data = resolve_post(session, post_id, headers, post, needs_image_details)
 
-        images = data.get('images', [])
+        images = post_image_urls(data) or []
         if not images:
             error = f"No images found for post ID {post_id}"
             logger.error(error)
@@ -1085,8 +1689,7 @@ def handle_image_download(post_id, session, headers, output_dir, filename_config
         output_folder = os.path.join(output_dir, name_creator, "images")
         os.makedirs(output_folder, exist_ok=True)
 
-        for idx, image in enumerate(images):
-            image_url = image.get('url')
+        for idx, image_url in enumerate(images):
             if not image_url:
                 continue
 
@@ -1101,17 +1704,15 @@ def handle_image_download(post_id, session, headers, output_dir, filename_config
             if os.path.exists(full_path):
                 message = f"Image already exists: {file_name}"
                 logger.info(message)
-                generate_metadata(data, file_name, output_folder, ext)
+                generate_metadata(data, file_name, output_folder, ext.replace('.', ''))
                 update_file_date(data, full_path)
                 # if progress_queue:
                 #     progress_queue.put(message)
                 continue
 
-            img_response = session.get(image_url, headers=headers)
-            img_response.raise_for_status()
-
-            with open(full_path, 'wb') as f:
-                f.write(img_response.content)
+            _, crc = download_to_file(session, image_url, full_path, headers)
+            dedupe_download(full_path, crc, progress_queue, data)
+            index_download(full_path)
 
             generate_metadata(data, file_name, output_folder, ext.replace('.', ''))
             update_file_date(data, full_path)
@@ -1130,141 +1731,226 @@ def handle_image_download(post_id, session, headers, output_dir, filename_config
             progress_queue.put(error)
         return False
 
-def validate_video_url(url, headers):
-    """Validate video URL is accessible"""
+def fetch_master_playlist(session: requests.Session, url: str, headers: Optional[dict] = None, timeout: float = 10) -> Optional[str]:
+    """Fetch and validate a master playlist in one request, returning its text or None"""
     try:
-        session = requests.Session()
-        session.headers.update(headers)  # Use session with headers
-        
-        response = session.head(url, allow_redirects=True, timeout=10)
-        
+        response = session.get(url, headers=headers, allow_redirects=True, timeout=timeout)
+
         if response.status_code != 200:
             logger.error(f"URL validation failed with status code {response.status_code}")
-            return False
-            
+            return None
+
         content_type = response.headers.get('content-type', '')
         valid_types = ['video', 'application/vnd.apple.mpegurl', 'application/x-mpegurl']
-        if not any(t in content_type.lower() for t in valid_types):
+        if not any(t in content_type.lower() for t in valid_types) and not response.text.startswith('#EXTM3U'):
             logger.error(f"Invalid content type: {content_type}")
-            return False
-            
-        return True
-        
+            return None
+
+        return response.text
+
     except Exception as e:
         logger.error(f"URL validation error: {str(e)}")
-        return False
+        return None
+
+def check_existing_file(post: Dict, output_dir: str, filename_config: Dict) -> bool:
+    """Check whether a verified video for the post already exists, removing corrupted ones"""
+    # Get post date
+    post_date = post.get('posted_at', '').split('T')[0] if post.get('posted_at') else 'unknown_date'
+
+    # Get username
+    username = post.get('user', {}).get('username', 'unknown')
+
+    output_folder = os.path.join(output_dir, username, "videos")
+
+    # Generate possible filenames (both old and new patterns)
+    possible_filenames = [
+        # New pattern with post ID, at every title length
+        *filename_candidates(post, filename_config, output_folder),
+        # Old pattern with {title}
+        f"{username}_{post_date}_{{title}}.mp4",
+        f"{username}_{post_date}_{{title}}_1.mp4"  # For split videos
+    ]
+
+    # Check if any of the possible filenames exist
+    for filename in possible_filenames:
+        full_path = os.path.join(output_folder, filename)
+        if os.path.exists(full_path) and os.path.getsize(full_path) > 0:
+            if verify_video_file(full_path, post_video_duration(post)):
+                # also update metadata and file dates (temp)
+                generate_metadata(post, filename, output_folder)
+                update_file_date(post, full_path)
+                logger.info(f"Found existing verified file: {filename}")
+                return True
+            else:
+                logger.warning(f"Found corrupted file, will redownload: {filename}")
+                try:
+                    os.remove(full_path)
+                except OSError as e:
+                    logger.error(f"Error removing corrupted file: {e}")
+    return False
+
+def get_verify_workers() -> int:
+    """Number of existing files verified at once, from VERIFY_WORKERS or the CPU count"""
+    try:
+        return max(1, int(os.getenv('VERIFY_WORKERS', str(os.cpu_count() or 4))))
+    except ValueError:
+        logger.warning("Invalid VERIFY_WORKERS, using the CPU count")
+        return os.cpu_count() or 4
 
-def check_existing_files(filtered_posts: List[Dict], output_dir: str, filename_config: Dict) -> Tuple[List[str], List[str]]:
+def iter_existence_checks(posts, output_dir: str, filename_config: Dict, max_workers: Optional[int] = None):
     """
-    Check which files already exist and verify their integrity.
-    Returns tuple of (existing_files, missing_files) where each is a list of post IDs.
+    Run check_existing_file over posts on a pool of verify workers and yield
+    (post, exists) as each check finishes. At most a few checks per worker are
+    queued ahead, so a listing generator is consumed no faster than it is verified.
     """
-    existing_files = []
-    missing_files = []
-    
-    for post in filtered_posts:
-        post_id = post.get('id')
-        if not post_id:
-            continue
+    max_workers = max_workers or get_verify_workers()
+    window = max_workers * 4
 
-        # Get post date
-        post_date = post.get('posted_at', '').split('T')[0] if post.get('posted_at') else 'unknown_date'
-        
-        # Get username
-        username = post.get('user', {}).get('username', 'unknown')
-        
-        # Generate possible filenames (both old and new patterns)
-        possible_filenames = [
-            # New pattern with post ID
-            generate_filename(post, filename_config, output_dir, '.mp4'),
-            # Old pattern with {title}
-            f"{username}_{post_date}_{{title}}.mp4",
-            f"{username}_{post_date}_{{title}}_1.mp4"  # For split videos
-        ]
-        
-        output_folder = os.path.join(output_dir, username, "videos")
-        
-        # Check if any of the possible filenames exist
-        found_valid_file = False
-        for filename in possible_filenames:
-            full_path = os.path.join(output_folder, filename)
-            if os.path.exists(full_path) and os.path.getsize(full_path) > 0:
-                if verify_video_file(full_path):
-                    existing_files.append(post_id)
-                    # also update metadata and file dates (temp)
-                    generate_metadata(post, filename, output_folder)
-                    update_file_date(post, full_path)
-                    logger.info(f"Found existing verified file: {filename}")
-                    found_valid_file = True
-                    break
+    def check(post):
+        try:
+            return check_existing_file(post, output_dir, filename_config)
+        except Exception as e:
+            logger.error(f"Error checking existing file for post {post.get('id')}: {e}")
+            return False
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='verify') as executor:
+        pending = {}
+        for post in posts:
+            if not post.get('id'):
+                continue
+            pending[executor.submit(check, post)] = post
+            if len(pending) >= window:
+                concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in [f for f in pending if f.done()]:
+                yield pending.pop(future), future.result()
+        for future in concurrent.futures.as_completed(list(pending)):
+            yield pending.pop(future), future.result()
+
+def iter_missing_posts(posts, output_dir: str, filename_config: Dict, stats: Dict[str, int], progress_queue=None):
+    """
+    Run the existence check in a background thread while posts are still being
+    listed, yielding the posts that need downloading as soon as they are known.
+    Files are verified in parallel, see iter_existence_checks.
+    Counts of total/existing/missing posts are kept in stats.
+    """
+    missing = Queue()
+
+    def producer():
+        try:
+            for post, exists in iter_existence_checks(posts, output_dir, filename_config):
+                stats['total'] += 1
+                if exists:
+                    stats['existing'] += 1
                 else:
-                    logger.warning(f"Found corrupted file, will redownload: {filename}")
-                    try:
-                        os.remove(full_path)
-                    except OSError as e:
-                        logger.error(f"Error removing corrupted file: {e}")
-        
-        if not found_valid_file:
-            missing_files.append(post_id)
-            
-    return existing_files, missing_files
+                    stats['missing'] += 1
+                    missing.put(post)
+        except Exception as e:
+            thread_safe_log('error', f"Error while listing posts: {e}", progress_queue)
+        finally:
+            missing.put(None)
+
+    threading.Thread(target=producer, daemon=True).start()
+    while True:
+        post = missing.get()
+        if post is None:
+            return
+        yield post
+
+# Rendered names per (post id, pattern, settings), least recently used dropped first
+FILENAME_MEMO_SIZE = 10000
+_filename_memo = OrderedDict()
+_filename_memo_lock = threading.Lock()
 
 def generate_filename(post: Dict, filename_config: Dict, output_dir: str, ext:str = '.mp4', max_length:int=100) -> str:
-    """Generate a unique filename for the video"""
-    username = post.get('user', {}).get('username', 'unknown')
+    """Generate the filename for a post from the compiled filename pattern"""
     post_id = post.get('id', 'unknown')
-    
-    # Debug-Ausgabe der verfügbaren Datums-Felder
-    date_fields = [field for field in post.keys() if 'date' in field.lower() or 'time' in field.lower() or 'at' in field.lower()]
-    logger.debug(f"Available date fields for post {post_id}: {date_fields}")
-    
-    # Explizite Prüfung jedes möglichen Datumsfeldes
-    post_date = None
-    if date_obj := get_post_date(post):
-        post_date = date_obj.strftime('%Y-%m-%d')
-        logger.info(f"Using date: {post_date} for post {post_id}")
-
-    # Fallback auf "unknown_date" wenn gar nichts funktioniert
-    if not post_date:
-        post_date = "unknown_date"
-        logger.warning(f"No date found for post {post_id}, dumping post data for debug")
-        # Log first 500 chars of post data for debugging
-        logger.debug(f"Post data excerpt: {str(post)[:500]}...")
-
-    # Get title or use part of post ID
-    title = post.get('title', '')
-    if not title or title.strip() == '':
-        title = post.get('body', '')
-    if not title or title.strip() == '':
-        title = post_id[:8]  # Use first 8 chars of post ID as title
-        
-    # Clean the title
-    title = clean_filename(title, max_length)
-    
-    # Get separator
-    separator = filename_config.get('separator', '_')
-    
-    # Generate filename based on pattern
     pattern = filename_config.get('pattern', '{creator}_{date}_{id}')
-    filename = pattern.replace('{creator}', username) \
-                     .replace('{date}', post_date) \
-                     .replace('{title}', title) \
-                     .replace('{id}', post_id)
-    
+    key = (post_id, pattern, filename_config.get('numbers', ''), filename_config.get('letters', ''), ext, max_length)
+    with _filename_memo_lock:
+        cached = _filename_memo.get(key)
+        if cached:
+            _filename_memo.move_to_end(key)
+    if cached:
+        return cached
+
+    template = compile_template(pattern)
+    values = {
+        'creator': post.get('user', {}).get('username', 'unknown'),
+        'id': str(post_id),
+        'number': filename_config.get('numbers', ''),
+        'letter': filename_config.get('letters', ''),
+    }
+
+    if 'date' in template.fields:
+        post_date = None
+        if date_obj := get_post_date(post):
+            post_date = date_obj.strftime('%Y-%m-%d')
+            logger.debug(f"Using date: {post_date} for post {post_id}")
+        # Fallback auf "unknown_date" wenn gar nichts funktioniert
+        if not post_date:
+            post_date = "unknown_date"
+            logger.warning(f"No date found for post {post_id}, dumping post data for debug")
+            logger.debug(f"Post data excerpt: {str(post)[:500]}...")
+        values['date'] = post_date
+
+    if 'title' in template.fields:
+        # Get title or use part of post ID
+        title = post.get('title', '')
+        if not title or title.strip() == '':
+            title = post.get('body', '')
+        if not title or title.strip() == '':
+            title = post_id[:8]  # Use first 8 chars of post ID as title
+        values['title'] = clean_filename(title, max_length)
+
+    filename = template.render(values)
+
     # Entferne doppelte post_id im Dateinamen (wenn vorhanden)
     base_name = os.path.splitext(filename)[0]
     if base_name.endswith(f"_{post_id}") and f"_{post_id}" in base_name[:-len(post_id)-1]:
         filename = base_name[:-len(post_id)-1] + ext
-    
+
     # Ensure extension
     if not filename.endswith(ext):
         filename += ext
 
-    logger.info(f"Generated filename for post {post_id}: {filename}")
+    logger.debug(f"Generated filename for post {post_id}: {filename}")
+    with _filename_memo_lock:
+        _filename_memo[key] = filename
+        if len(_filename_memo) > FILENAME_MEMO_SIZE:
+            _filename_memo.popitem(last=False)
     return filename
 
+def fitted_filename(post: Dict, filename_config: Dict, output_folder: str, ext: str = '.mp4') -> str:
+    """
+    Generate the filename with the longest title, cut in steps of 10 from 100
+    characters, whose encoded name plus a .json metadata suffix fits the
+    folder's filesystem limit.
+    """
+    limit = name_max(output_folder) - len('.json')
+    for max_length in range(100, 10, -10):
+        filename = generate_filename(post, filename_config, output_folder, ext, max_length=max_length)
+        if len(os.fsencode(filename)) <= limit:
+            break
+    return filename
+
+def filename_candidates(post: Dict, filename_config: Dict, output_folder: str, ext: str = '.mp4') -> List[str]:
+    """
+    Names a post's file may have on disk: the fitted name first, then the name
+    at every other title length, which older versions picked by probing.
+    """
+    names = [fitted_filename(post, filename_config, output_folder, ext)]
+    for max_length in range(100, 10, -10):
+        filename = generate_filename(post, filename_config, output_folder, ext, max_length=max_length)
+        if filename not in names:
+            names.append(filename)
+    return names
 
 def generate_metadata(post: Dict, filename: str, output_dir: str, ext: str = 'mp4'):
+    """
+    Record gallery-dl style metadata for a media file in the metadata catalog.
+    The {filename}.json sidecar (METADATA_SIDECARS=1) is only written when the
+    metadata changed or the sidecar is missing.
+    """
     enabled = int(os.getenv('WRITE_METADATA', '0'))
     if not enabled:
         return
@@ -1281,25 +1967,32 @@ def generate_metadata(post: Dict, filename: str, output_dir: str, ext: str = 'mp
     if date_obj:
         post_date = date_obj.strftime('%Y-%m-%d %H:%M:%S')
 
+    metadata = {
+        "service": "myfans",
+        "category": "myfans",
+        "subcategory": "myfans",
+        "id": str(post_id),
+        "is_preview": False,
+        "user": str(user_id),
+        "username": username,
+        "content": post_body,
+        "post_id": str(post_id),
+        "type": "attachment",
+        "extension": ext,
+        "date": str(post_date),
+        "post_date": str(post_date),
+        "media_date": str(post_date)
+    }
+    changed = get_metadata_catalog().record(username, os.path.join(output_dir, filename), metadata)
+
+    if not int(os.getenv('METADATA_SIDECARS', '1')):
+        return
     metadata_path = os.path.join(output_dir, f"{filename}.json")
+    if not changed and os.path.exists(metadata_path):
+        return
     with open(metadata_path, "w") as f:
-        f.write(f'''{{
-  "service": "myfans",
-  "category": "myfans",
-  "subcategory": "myfans",
-  "id": "{post_id}",
-  "is_preview": false,
-  "user": "{user_id}",
-  "username": "{username}",
-  "content": "{post_body}",
-  "post_id": "{post_id}",
-  "type": "attachment",
-  "extension": "{ext}",
-  "date": "{post_date}",
-  "post_date": "{post_date}",
-  "media_date": "{post_date}"
-}}
-''')
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+        f.write("\n")
     update_file_date(post, metadata_path)
 
 
@@ -1325,7 +2018,25 @@ def update_file_date(post: Dict, full_path: str):
     date_obj = get_post_date(post)
     if date_obj:
         timestamp = date_obj.timestamp()
+        st = os.stat(full_path)
+        # Leave files that already carry the post date alone, so re-syncs touch nothing
+        if abs(st.st_mtime - timestamp) < 1e-3:
+            return
+        try:
+            index = get_verification_index()
+            cached = index.lookup(full_path, st)
+        except Exception as e:
+            logger.warning(f"Verification cache unavailable for {full_path}: {e}")
+            index = cached = None
         os.utime(full_path, (timestamp, timestamp))
+        # Only the mtime changed, keep a known verdict valid for the new stat
+        if cached is not None:
+            try:
+                index.store(full_path, os.stat(full_path), *cached)
+            except Exception as e:
+                logger.warning(f"Could not carry verification result over for {full_path}: {e}")
+
+CONTROL_CHARS_RE = re.compile(r'[\x00-\x1f]')
 
 def clean_filename(filename: str, max_length:int = 100) -> str:
     """Clean a string to make it safe for filenames"""
@@ -1335,7 +2046,7 @@ def clean_filename(filename: str, max_length:int = 100) -> str:
         filename = filename.replace(char, '_')
     
     # Remove or replace other problematic characters
-    filename = re.sub(r'[\x00-\x1f]', '', filename)
+    filename = CONTROL_CHARS_RE.sub('', filename)
     filename = filename.strip('. ')  # Remove leading/trailing dots and spaces
     
     # Limit length
@@ -1386,7 +2097,7 @@ def validate_filename_config(filename_config: Dict) -> bool:
     return True
 
 def main():
-    session = requests.Session()
+    session = get_session()
     config_file_path = 'config.ini'
 
     if os.path.isfile(config_file_path):
@@ -1427,6 +2138,7 @@ def main():
 
     filename_config = read_filename_config(config)
     validate_filename_config(filename_config)
+    cleanup_orphaned_spools(output_dir)
 
     while True:
         name_creator = input("Enter a creator's username (without @) or type '0' to exit: ")
@@ -1435,7 +2147,7 @@ def main():
         new_base_url = f"https://api.myfans.jp/api/v2/users/show_by_username?username={name_creator}"
         headers = read_headers_from_file("header.txt")
         try:
-            response = requests.get(new_base_url, headers=headers)
+            response = session.get(new_base_url, headers=headers)
             response.raise_for_status()
             new_json_data = response.json()
             user_id = new_json_data.get("id")
@@ -1466,60 +2178,19 @@ def main():
                 print("Failed to retrieve user ID. Please check the username and try again.")
                 return
             
-            # Fetch regular posts
-            base_url = f"https://api.myfans.jp/api/v2/users/{user_id}/posts?page="
-            print("Fetching regular posts...")
-            video_posts = []
-            page = 1
-            
-            with tqdm(desc="Fetching regular posts") as pbar:
-                while True:
-                    try:
-                        response = requests.get(base_url + str(page), headers=headers)
-                        response.raise_for_status()
-                        json_data = response.json()
-                        
-                        if not json_data.get("data"):
-                            break
-                            
-                        for post in json_data["data"]:
-                            if post.get("kind") == "video":
-                                video_posts.append(post)
-                        
-                        page += 1
-                        pbar.update(1)
-                        
-                    except requests.RequestException as e:
-                        print(f"\nError fetching page {page}: {e}")
-                        break
-            
-            # Fetch back number plan posts if available
-            if back_number_plan:
-                print("\nFetching back number plan posts...")
-                back_plan_url = f"https://api.myfans.jp/api/v2/users/{user_id}/back_number_posts?page="
-                page = 1
-                
-                with tqdm(desc="Fetching back plan posts") as pbar:
-                    while True:
-                        try:
-                            response = requests.get(back_plan_url + str(page), headers=headers)
-                            response.raise_for_status()
-                            json_data = response.json()
-                            
-                            if not json_data.get("data"):
-                                break
-                                
-                            for post in json_data["data"]:
-                                if post.get("kind") == "video":
-                                    video_posts.append(post)
-                            
-                            page += 1
-                            pbar.update(1)
-                            
-                        except requests.RequestException as e:
-                            print(f"\nError fetching back plan page {page}: {e}")
-                            break
-            
+            catalog = PostCatalog()
+            try:
+                # Fetch regular posts
+                print("Fetching regular posts...")
+                video_posts = list_user_posts(session, user_id, 'posts', 'video', catalog=catalog, headers=headers)
+
+                # Fetch back number plan posts if available
+                if back_number_plan:
+                    print("\nFetching back number plan posts...")
+                    video_posts.extend(list_user_posts(session, user_id, 'back_number_posts', 'video', catalog=catalog, headers=headers))
+            finally:
+                catalog.close()
+
             print(f"\nTotal video posts found: {len(video_posts)}")
 
             print("Select which posts to download:")
@@ -1540,7 +2211,8 @@ def main():
                 return
 
             selected_resolution = 'best'
-            download_videos_concurrently(session, post_ids, selected_resolution, output_dir, filename_config)
+            download_videos_concurrently(session, post_ids, selected_resolution, output_dir, filename_config,
+                                         max_workers=max_workers)
 
         except requests.RequestException as e:
             print(f"An error occurred while fetching posts: {e}")
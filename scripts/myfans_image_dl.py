@@ -1,4 +1,4 @@
-import requests, os, configparser, time
+import requests, os, sys, configparser, time
 from tqdm import tqdm
 from collections import defaultdict
 from math import ceil
@@ -7,6 +7,13 @@ from PIL import Image
 
 from concurrent.futures import ThreadPoolExecutor
 
+# main.py runs this file as a script, so make the scripts package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.http_client import get_session
+
+# Shared keep-alive session for the API and image CDN
+session = get_session()
+
 # Function to read headers from a file and store them in a dictionary
 def read_headers_from_file(filename):
     headers = {}
@@ -19,7 +26,7 @@ def read_headers_from_file(filename):
 # Function to get posts for a specific page
 def get_posts_for_page(base_url, page, headers):
     url = base_url + str(page)
-    response = requests.get(url, headers=headers)
+    response = session.get(url, headers=headers)
     json_data = response.json()
     return json_data.get("data", [])
 
@@ -55,7 +62,7 @@ new_base_url = f"https://api.myfans.jp/api/v2/users/show_by_username?username={n
 headers = read_headers_from_file("header.txt")
 
 # Retrieve the "id" from the new API endpoint
-response = requests.get(new_base_url, headers=headers)
+response = session.get(new_base_url, headers=headers)
 new_json_data = response.json()
 user_id = new_json_data.get("id")
 
@@ -106,7 +113,7 @@ def download_image(url, image_name):
         return
     try:
         # Send an HTTP request to the URL
-        response = requests.get(url)
+        response = session.get(url, headers={})
         
         # Check if the request was successful (status code 200)
         if response.status_code == 200:
@@ -0,0 +1,116 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+DATE_FIELDS = ('posted_at', 'published_at', 'created_at')
+# Per-viewer fields that go stale: signed video URLs and the access flag
+VOLATILE_FIELDS = ('videos', 'subscribed')
+
+class PostCatalog:
+    """On-disk catalog of every post seen per creator and feed, used for incremental syncs"""
+
+    def __init__(self, state_dir=None):
+        if state_dir is None:
+            state_dir = os.getenv('CONFIG_DIR', '')
+        self.db_file = os.path.join(state_dir, "post_catalog.db")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS posts (
+                    user_id TEXT NOT NULL,
+                    feed TEXT NOT NULL,
+                    post_id TEXT NOT NULL,
+                    kind TEXT,
+                    free INTEGER,
+                    published_at TEXT,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (user_id, feed, post_id)
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    user_id TEXT NOT NULL,
+                    feed TEXT NOT NULL,
+                    complete INTEGER NOT NULL DEFAULT 0,
+                    last_synced TEXT,
+                    PRIMARY KEY (user_id, feed)
+                )""")
+
+    @staticmethod
+    def _published_at(post):
+        for field in DATE_FIELDS:
+            if post.get(field):
+                return post[field]
+        return None
+
+    def known_post_ids(self, user_id, feed):
+        """Return the IDs already stored for a creator's feed"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT post_id FROM posts WHERE user_id = ? AND feed = ?",
+                (str(user_id), feed)).fetchall()
+        return {row[0] for row in rows}
+
+    def is_complete(self, user_id, feed):
+        """Whether a previous sync reached the end of the feed, so later syncs may stop early"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT complete FROM sync_state WHERE user_id = ? AND feed = ?",
+                (str(user_id), feed)).fetchone()
+        return bool(row and row[0])
+
+    def add_posts(self, user_id, feed, posts):
+        """Insert or refresh posts from a listing page"""
+        rows = [
+            (str(user_id), feed, str(post.get('id')), post.get('kind'),
+             1 if post.get('free') else 0, self._published_at(post), json.dumps(post))
+            for post in posts if post.get('id')
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany("""
+                INSERT INTO posts (user_id, feed, post_id, kind, free, published_at, payload)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, feed, post_id) DO UPDATE SET
+                    kind = excluded.kind,
+                    free = excluded.free,
+                    published_at = excluded.published_at,
+                    payload = excluded.payload""", rows)
+
+    def mark_synced(self, user_id, feed, complete):
+        """Record the outcome of a sync"""
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO sync_state (user_id, feed, complete, last_synced)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, feed) DO UPDATE SET
+                    complete = excluded.complete,
+                    last_synced = excluded.last_synced""",
+                (str(user_id), feed, 1 if complete else 0, datetime.now().isoformat()))
+
+    def get_posts(self, user_id, feed, kind=None):
+        """
+        Return stored posts, newest first, optionally filtered by kind. Volatile
+        fields are dropped, so video posts get fresh details before download.
+        """
+        query = "SELECT payload FROM posts WHERE user_id = ? AND feed = ?"
+        params = [str(user_id), feed]
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        query += " ORDER BY published_at DESC"
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        posts = [json.loads(row[0]) for row in rows]
+        for post in posts:
+            for field in VOLATILE_FIELDS:
+                post.pop(field, None)
+        return posts
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
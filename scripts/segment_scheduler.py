@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger('myfans_downloader')
+
+class SegmentJob:
+    """Segments of one video queued on the shared scheduler, indexed by playlist position"""
+
+    def __init__(self, scheduler, tasks, ready=None):
+        self.scheduler = scheduler
+        self.tasks = tasks
+        # ready(index) lets the owner hold back segments, e.g. while its reorder buffer is full
+        self.ready = ready or (lambda index: True)
+        self.next_index = 0
+        self.running = 0
+        self.cancelled = False
+
+    @property
+    def finished(self):
+        return (self.cancelled or self.next_index >= len(self.tasks)) and self.running == 0
+
+    def cancel(self):
+        """Drop segments that have not started yet"""
+        self.scheduler.cancel(self)
+
+    def wait(self):
+        """Block until every started segment has finished"""
+        self.scheduler.wait(self)
+
+class SegmentScheduler:
+    """
+    Process-wide pool of segment workers shared by every active video.
+    Idle workers take the next segment of the oldest video that still has work,
+    so the pipe stays full while another video is finishing its stragglers.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.jobs = []
+        self.threads = []
+        self.cond = threading.Condition()
+
+    @property
+    def worker_count(self):
+        return self.workers or int(os.getenv('SEGMENT_DOWNLOAD_THREADS', '15'))
+
+    def _ensure_workers(self):
+        if self.threads:
+            return
+        for n in range(self.worker_count):
+            thread = threading.Thread(target=self._worker, name=f"segment-worker-{n}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, tasks, ready=None):
+        """Queue a video's segment tasks and return its job handle"""
+        job = SegmentJob(self, list(tasks), ready)
+        with self.cond:
+            self._ensure_workers()
+            self.jobs.append(job)
+            self.cond.notify_all()
+        return job
+
+    def notify(self):
+        """Re-check held-back segments, called when a job's ready() may have changed"""
+        with self.cond:
+            self.cond.notify_all()
+
+    def cancel(self, job):
+        with self.cond:
+            job.cancelled = True
+            self.cond.notify_all()
+
+    def wait(self, job):
+        with self.cond:
+            while not job.finished:
+                self.cond.wait()
+            if job in self.jobs:
+                self.jobs.remove(job)
+
+    def _next_task(self):
+        for job in self.jobs:
+            if not job.cancelled and job.next_index < len(job.tasks) and job.ready(job.next_index):
+                index = job.next_index
+                job.next_index += 1
+                job.running += 1
+                return job, index
+        return None
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                picked = self._next_task()
+                while picked is None:
+                    self.cond.wait()
+                    picked = self._next_task()
+            job, index = picked
+            try:
+                job.tasks[index]()
+            except Exception as e:
+                logger.error(f"Error in segment task {index}: {str(e)}")
+            finally:
+                with self.cond:
+                    job.running -= 1
+                    if job.finished and job in self.jobs:
+                        self.jobs.remove(job)
+                    self.cond.notify_all()
+
+segment_scheduler = SegmentScheduler()
@@ -0,0 +1,50 @@
+from typing import Optional
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+class CorruptSegmentError(ValueError):
+    """A segment body failed validation and should be fetched again"""
+
+def expected_body_length(response) -> Optional[int]:
+    """Content-Length of a response body as it will be read, None if unknown or content-encoded"""
+    encoding = response.headers.get('Content-Encoding', 'identity').lower()
+    length = response.headers.get('Content-Length')
+    if encoding != 'identity' or not length or not length.isdigit():
+        return None
+    return int(length)
+
+def segment_is_plain(segment) -> bool:
+    """Whether a playlist segment is unencrypted MPEG-TS whose sync bytes can be checked"""
+    key = getattr(segment, 'key', None)
+    return key is None or not key.method or key.method.upper() == 'NONE'
+
+class TsValidator:
+    """
+    Checks an MPEG-TS body chunk by chunk as it is downloaded: every 188-byte
+    packet must start with the 0x47 sync byte, the body must be a whole number
+    of packets and, when known, match the response Content-Length.
+    """
+
+    def __init__(self, check_sync: bool = True):
+        self.check_sync = check_sync
+        self.size = 0
+
+    def feed(self, chunk):
+        if self.check_sync:
+            # Offset of the first packet boundary inside this chunk
+            first = (-self.size) % TS_PACKET_SIZE
+            sync_bytes = bytes(chunk[first::TS_PACKET_SIZE])
+            if sync_bytes.count(TS_SYNC_BYTE) != len(sync_bytes):
+                bad = next(i for i, b in enumerate(sync_bytes) if b != TS_SYNC_BYTE)
+                offset = self.size + first + bad * TS_PACKET_SIZE
+                raise CorruptSegmentError(f"lost TS sync at packet {offset // TS_PACKET_SIZE}")
+        self.size += len(chunk)
+
+    def finish(self, expected_length: Optional[int] = None):
+        if not self.size:
+            raise CorruptSegmentError("empty segment")
+        if expected_length is not None and self.size != expected_length:
+            raise CorruptSegmentError(f"got {self.size} of {expected_length} bytes")
+        if self.check_sync and self.size % TS_PACKET_SIZE:
+            raise CorruptSegmentError(f"{self.size} bytes is not a whole number of TS packets")
@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+from typing import List, Optional
+
+logger = logging.getLogger('myfans_downloader')
+
+# Short side in pixels of each resolution offered by the API
+RESOLUTION_HEIGHTS = {'uhd': 2160, 'fhd': 1080, 'hd': 720, 'sd': 480, 'ld': 360}
+RESOLUTION_ORDER = ['uhd', 'fhd', 'hd', 'sd', 'ld']
+
+def fallback_resolutions(requested: str) -> List[str]:
+    """Resolutions to try when the requested one is missing, nearest lower ones first"""
+    if requested not in RESOLUTION_ORDER:
+        return list(RESOLUTION_ORDER)
+    index = RESOLUTION_ORDER.index(requested)
+    return RESOLUTION_ORDER[index:] + RESOLUTION_ORDER[:index][::-1]
+
+def variant_height(variant) -> Optional[int]:
+    """Short side of a variant's RESOLUTION, so portrait clips are ranked like landscape ones"""
+    resolution = variant.stream_info.resolution if variant.stream_info else None
+    if not resolution:
+        return None
+    return min(resolution)
+
+def estimate_variant_bytes(variant, top_bandwidth: int, duration: float = 0, size_hint: int = 0) -> Optional[int]:
+    """
+    Expected download size of a variant: bandwidth times duration when the API
+    reports a duration, otherwise the API size scaled by the bandwidth ratio.
+    """
+    bandwidth = variant.stream_info.bandwidth
+    if duration:
+        return int(bandwidth * duration / 8)
+    if size_hint and top_bandwidth:
+        return int(size_hint * bandwidth / top_bandwidth)
+    return None
+
+def select_variant(playlists, max_height: Optional[int] = None, max_bandwidth: int = 0,
+                   byte_limit: Optional[int] = None, duration: float = 0, size_hint: int = 0):
+    """
+    Pick the highest-bandwidth variant that is no taller than max_height, no
+    faster than max_bandwidth and whose estimated size fits byte_limit.
+    When nothing passes the height or bandwidth caps the lowest variant is used;
+    when nothing fits byte_limit None is returned.
+    """
+    variants = sorted((p for p in playlists if p.stream_info and p.stream_info.bandwidth),
+                      key=lambda p: p.stream_info.bandwidth, reverse=True)
+    if not variants:
+        return None
+
+    candidates = variants
+    if max_height:
+        candidates = [p for p in candidates if (variant_height(p) or 0) <= max_height]
+    if max_bandwidth:
+        candidates = [p for p in candidates if p.stream_info.bandwidth <= max_bandwidth]
+    if not candidates:
+        candidates = variants[-1:]
+
+    if byte_limit is None:
+        return candidates[0]
+
+    top_bandwidth = variants[0].stream_info.bandwidth
+    for variant in candidates:
+        estimate = estimate_variant_bytes(variant, top_bandwidth, duration, size_hint)
+        if estimate is None or estimate <= byte_limit:
+            return variant
+    return None
+
+class DiskBudget:
+    """
+    Per-creator byte quota for downloaded videos. Usage starts from what is
+    already in the creator's folder; downloads reserve their estimated size
+    up front so concurrent videos of one creator cannot overshoot together.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.used = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        limit_gb = float(os.getenv('CREATOR_DISK_BUDGET_GB', '0'))
+        return cls(int(limit_gb * 1024 ** 3))
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit_bytes > 0
+
+    @staticmethod
+    def _folder_usage(folder: str) -> int:
+        total = 0
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            pass
+        return total
+
+    def remaining(self, folder: str) -> int:
+        with self.lock:
+            if folder not in self.used:
+                self.used[folder] = self._folder_usage(folder)
+            return max(0, self.limit_bytes - self.used[folder])
+
+    def reserve(self, folder: str, nbytes: int) -> bool:
+        """Claim nbytes of the folder's quota, False if it no longer fits"""
+        self.remaining(folder)
+        with self.lock:
+            if self.used[folder] + nbytes > self.limit_bytes:
+                return False
+            self.used[folder] += nbytes
+            return True
+
+    def settle(self, folder: str, reserved: int, actual: int):
+        """Replace a reservation with the bytes actually written (0 on failure)"""
+        with self.lock:
+            self.used[folder] = self.used.get(folder, 0) - reserved + actual
+
+disk_budget = DiskBudget.from_env()
@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+class VerificationIndex:
+    """
+    Persistent record of video verification results keyed by path. An entry is
+    trusted only while the file's inode, size and mtime_ns still match, so a
+    replaced or modified file is re-probed on its next check.
+    """
+
+    def __init__(self, state_dir=None):
+        if state_dir is None:
+            state_dir = os.getenv('CONFIG_DIR', '')
+        self.db_file = os.path.join(state_dir, "verify_cache.db")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    inode INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    verdict INTEGER NOT NULL,
+                    duration REAL,
+                    checked_at TEXT
+                )""")
+
+    def lookup(self, path, st):
+        """Return (verdict, duration) for an unchanged file, None if unknown or stale"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT inode, size, mtime_ns, verdict, duration FROM files WHERE path = ?",
+                (path,)).fetchone()
+        if not row or tuple(row[:3]) != (st.st_ino, st.st_size, st.st_mtime_ns):
+            return None
+        return bool(row[3]), row[4]
+
+    def store(self, path, st, verdict, duration=None):
+        """Record the verdict for the file as it is described by st"""
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO files (path, inode, size, mtime_ns, verdict, duration, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    inode = excluded.inode,
+                    size = excluded.size,
+                    mtime_ns = excluded.mtime_ns,
+                    verdict = excluded.verdict,
+                    duration = excluded.duration,
+                    checked_at = excluded.checked_at""",
+                (path, st.st_ino, st.st_size, st.st_mtime_ns, 1 if verdict else 0, duration,
+                 datetime.now().isoformat()))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+_index_lock = threading.Lock()
+_index = None
+
+def get_verification_index():
+    """Return the process-wide verification index, opened on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VerificationIndex()
+        return _index